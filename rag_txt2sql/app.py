@@ -1,26 +1,27 @@
 import streamlit as st
-import sqlite3
-import pandas as pd
+import time
 import os
 import re
-import json
 from dotenv import load_dotenv
-from query_llm import LLMQueryHandler
+from query_llm import LLMQueryHandler, parse_candidates
 from system_prompt import sys_prompt
+from sql_engine import get_engine, ExecutionResult
+from metrics_store import get_metrics_store
 load_dotenv()
 
 VECTOR_STORE = os.environ.get("VECTOR_STORE")
 EMBED_MODEL = os.environ.get("EMBED_MODEL")
 GPT_MODEL = os.environ.get("GPT_MODEL")
-METRIC_FILENAME = os.environ.get("METRIC_FILENAME")
 CONTEXT_PROMPT_FILE_PATH = os.environ.get("CONTEXT_PROMPT_FILE_PATH")
 DB_PATH = os.environ.get("DB_PATH", "patient_health_data.db")
+RESULTS_PAGE_SIZE = int(os.environ.get("RESULTS_PAGE_SIZE", "100"))
+LLM_CANDIDATES = parse_candidates(os.environ.get("LLM_CANDIDATES"))
 
 def get_column_names_from_db(db_path: str, sql_query: str) -> list[str]:
     """
     Retrieves the column names from a SQL query execution result.
 
-    This function connects to a SQLite database, executes a provided SQL query,
+    This function executes a provided SQL query on a pooled read-only connection
     and extracts the column names from the query result.
 
     Parameters:
@@ -32,20 +33,12 @@ def get_column_names_from_db(db_path: str, sql_query: str) -> list[str]:
     ----
     - list[str]: A list of column names (str) from the SQL query result.
     """
-    cols = []
-    with sqlite3.connect(db_path) as connection:
-        cursor = connection.cursor()
-        data = cursor.execute(sql_query)
-        n_cols = len(data.description)
-        for i in range(n_cols):
-            cols.append(data.description[i][0])
+    return get_engine(db_path).get_column_names(sql_query)
 
-    return cols
 
-
-def execute_sql_on_db(db_path: str, query: str, params=None) -> tuple[pd.DataFrame | None, str | None]:
+def execute_sql_on_db(db_path: str, query: str, params=None) -> ExecutionResult:
     """
-    Executes SQL query on specified SQLite3 database and returns a tuple (DataFrame, error).
+    Executes SQL query on specified SQLite3 database and returns its ExecutionResult.
 
     Parameters:
     ----
@@ -55,17 +48,11 @@ def execute_sql_on_db(db_path: str, query: str, params=None) -> tuple[pd.DataFra
 
     Returns:
     ----
-    - (pandas.DataFrame | None, str | None): Tuple where the first element is the query result
-      DataFrame when successful, otherwise None; the second element is an error message when
-      execution failed, otherwise None.
+    - ExecutionResult: Holds the query result DataFrame when successful, otherwise an error
+      message, along with the row count and execution time.
     """
-    with sqlite3.connect(db_path) as connection:
-        try:
-            df = pd.read_sql_query(query, connection, params)
-            return df, None
-        except Exception as e:
-            # Return the error message so the caller (UI / CLI) can parse and display it
-            return None, str(e)
+    # Errors come back as a message so the caller (UI / CLI) can parse and display it
+    return get_engine(db_path).execute(query, params)
              
 def display_schemas(schemas):
     st.markdown("## Semantically Similar Schemas")
@@ -103,43 +90,17 @@ def display_schemas(schemas):
 
 
 def reset_app():
-    keys_to_reset = ["user_has_interacted", "context_prompt", "user_prompt"]
+    keys_to_reset = ["user_has_interacted", "context_prompt", "user_prompt", "last_run"]
     for key in keys_to_reset:
         st.session_state[key] = "" if key == "user_prompt" else None
 
 
-def update_query_cost(new_cost):
-    data = read_metric_file()
-    if data["total_cost"] is None:
-        data["total_cost"] = 0.0
-    data["total_cost"] += new_cost
-    with open(METRIC_FILENAME, "w") as f:
-        json.dump(data, f)
-
-
 def get_visitor_count():
-    with open(METRIC_FILENAME, "r") as f:
-        data = json.load(f)
-        return data["visitor_count"]
+    return int(get_metrics_store().get_counter("visitor_count"))
 
 
 def increment_visitor_count():
-    data = read_metric_file()
-    data["visitor_count"] += 1
-    with open(METRIC_FILENAME, "w") as f:
-        json.dump(data, f)
-
-
-def read_metric_file():
-    if not os.path.exists(METRIC_FILENAME):
-        with open(METRIC_FILENAME, "w") as f:
-            data = {"total_cost": 0.0, "visitor_count": 0}
-            json.dump(data, f)
-        return data
-    else:
-        with open(METRIC_FILENAME, "r") as f:
-            data = json.load(f)
-        return data
+    get_metrics_store().increment("visitor_count")
 
 # try:
 #     with open(CONTEXT_PROMPT_FILE_PATH) as f:
@@ -307,23 +268,37 @@ run_query = st.button("🚀 Run Query", type="primary")
 # -------------------------
 if run_query and user_prompt.strip():
 
+    # Filled token by token while the LLM generates, then replaced by the tabs below
+    live_sql = st.empty()
+
+    def render_partial_sql(token: str, sql_so_far: str):
+        with live_sql.container():
+            st.subheader("Generated SQL Query")
+            st.code(sql_so_far, language="sql")
+
     with st.spinner("Processing your query..."):
         try:
+            # Only the first page is fetched here; later pages are loaded lazily below
             handler = LLMQueryHandler(
                 model=GPT_MODEL,
                 vector_store=VECTOR_STORE,
                 embed_model=EMBED_MODEL,
                 db_path=DB_PATH,
                 top_k=3,
+                max_rows=RESULTS_PAGE_SIZE,
+                candidates=LLM_CANDIDATES,
+                stream_callback=render_partial_sql,
             )
 
+            start = time.perf_counter()
             schemas = handler.get_semantic_schemas(user_prompt)
             system_prompt = sys_prompt.format(
                 schemas="\n\n".join(schemas),
                 context=context_prompt,
             )
 
-            df, output = handler.process_user_query(
+            # The handler already executed the SQL against DB_PATH; render that result
+            result, output = handler.process_user_query(
                 schemas,
                 user_prompt,
                 context_prompt,
@@ -334,50 +309,110 @@ if run_query and user_prompt.strip():
                 st.error("❌ Failed to generate a valid SQL query.")
                 st.stop()
 
-            sql_query = output.get("SQL_QUERY")
+            # Priced per attempt by the handler, so mixed-model candidates are costed correctly
+            cost = output.get("COST", 0.0)
+            get_metrics_store().record_query(
+                output, time.perf_counter() - start, result.error
+            )
+
+            # Kept in the session so paging through results survives script reruns
+            st.session_state.last_run = {
+                "result": result,
+                "output": output,
+                "cost": cost,
+                # Row offset each page starts at, known up to the last page loaded
+                "page_starts": [0],
+            }
+            st.session_state.results_page = 1
 
-            # Execute SQL
-            df, sql_error = execute_sql_on_db("patient_health_data.db", sql_query)
+        except Exception as e:
+            st.error(f"⚠️ Error occurred: {e}")
+        finally:
+            live_sql.empty()
 
-            if sql_error:
-                # Show detailed error in expandable box and a short warning
-                st.warning("⚠️ The SQL query returned an error. Please review and try again.")
-                with st.expander("View SQL Error"):
-                    st.code(sql_error)
+# -------------------------
+# Results
+# -------------------------
+last_run = st.session_state.get("last_run")
+if last_run:
+    result = last_run["result"]
+    sql_query = last_run["output"].get("SQL_QUERY")
+
+    if result.error:
+        # Show detailed error in expandable box and a short warning
+        if result.rejected:
+            st.warning("⚠️ The SQL query was stopped because it would be too expensive to run.")
+        else:
+            st.warning("⚠️ The SQL query returned an error. Please review and try again.")
+        with st.expander("View SQL Error"):
+            st.code(result.error)
+    else:
+        # -------------------------
+        # Tabs
+        # -------------------------
+        tab_results, tab_sql, tab_cost = st.tabs(
+            ["📊 Results", "🧠 Generated SQL", "💰 Cost & Metrics"]
+        )
+
+        with tab_results:
+            st.subheader("Query Results")
+            page = 1
+            if result.truncated:
+                page = st.number_input("Page", min_value=1, step=1, key="results_page")
+
+            page_starts = last_run["page_starts"]
+            page_result = result
+            # Pages can stop short at SQL_MAX_BYTES, so each page starts where the previous
+            # one ended; jumping ahead loads the pages in between to find where that is
+            for loaded_page in range(1, page + 1):
+                if loaded_page > len(page_starts):
+                    break
+                if loaded_page < page and loaded_page < len(page_starts):
+                    continue
+                if loaded_page > 1:
+                    page_result = get_engine(DB_PATH).fetch_page(
+                        sql_query, page_starts[loaded_page - 1], RESULTS_PAGE_SIZE
+                    )
+                if page_result.error or not page_result.truncated:
+                    break
+                if loaded_page == len(page_starts):
+                    page_starts.append(page_starts[-1] + page_result.n_rows)
+
+            if page_result.error:
+                st.warning(f"⚠️ Could not load page {page}: {page_result.error}")
+            elif page > len(page_starts):
+                st.info(f"The results end before page {page}.")
             else:
-                # -------------------------
-                # Tabs
-                # -------------------------
-                tab_results, tab_sql, tab_cost = st.tabs(
-                    ["📊 Results", "🧠 Generated SQL", "💰 Cost & Metrics"]
+                st.caption(
+                    f"{page_result.n_rows} rows in {page_result.elapsed_seconds * 1000:.1f} ms"
+                    + (" (more available)" if page_result.truncated else "")
                 )
+                st.dataframe(page_result.df, use_container_width=True)
 
-                with tab_results:
-                    st.subheader("Query Results")
-                    st.dataframe(df, use_container_width=True)
+        with tab_sql:
+            st.subheader("Generated SQL Query")
+            st.code(sql_query, language="sql")
 
-                with tab_sql:
-                    st.subheader("Generated SQL Query")
-                    st.code(sql_query, language="sql")
+        with tab_cost:
+            totals = get_metrics_store().totals()
 
-                with tab_cost:
-                    cost = handler.calculate_query_execution_cost(
-                        output.get("N_PROMPT_TOKENS", 0),
-                        output.get("N_GENERATED_TOKENS", 0),
-                    )
-                    update_query_cost(cost)
-                    data = read_metric_file()
+            output = last_run["output"]
+            ttft = output.get("TTFT_SECONDS")
 
-                    col1, col2 = st.columns(2)
-                    col1.metric("Query Cost ($)", f"{cost:.6f}")
-                    col2.metric("Total Cost ($)", f"{data.get('total_cost', 0):.6f}")
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Query Cost ($)", f"{last_run['cost']:.6f}")
+            col2.metric("Total Cost ($)", f"{totals['total_cost']:.6f}")
+            col3.metric("Time to First Token (s)", "—" if ttft is None else f"{ttft:.2f}")
 
-            # -------------------------
-            # Reset
-            # -------------------------
-            if st.button("🔄 Reset App"):
-                reset_app()
-                st.experimental_rerun()
+            st.caption(
+                f"Prompt tokens: {output.get('N_PROMPT_TOKENS', 0)} "
+                f"({output.get('N_CACHED_TOKENS', 0)} served from the provider's prompt cache), "
+                f"generated tokens: {output.get('N_GENERATED_TOKENS', 0)}"
+            )
 
-        except Exception as e:
-            st.error(f"⚠️ Error occurred: {e}")
+    # -------------------------
+    # Reset
+    # -------------------------
+    if st.button("🔄 Reset App"):
+        reset_app()
+        st.experimental_rerun()
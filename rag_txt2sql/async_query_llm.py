@@ -0,0 +1,259 @@
+import asyncio
+import threading
+import time
+from typing import Callable
+from query_llm import LLMQueryHandler, RepairLoop, Speculation, StreamedCompletion, logger
+from llm_clients import get_async_openai_client, get_async_anthropic_client
+from result_cache import get_result_cache
+from sql_engine import ExecutionResult
+
+# Speculative candidates still generating after their question was answered
+_late_candidates: set[asyncio.Task] = set()
+
+
+class AsyncLLMQueryHandler(LLMQueryHandler):
+    """
+    asyncio variant of LLMQueryHandler.
+
+    The conversation for each question is kept local to the call instead of on self.messages,
+    so one handler can serve many questions concurrently. max_concurrency bounds how many
+    questions are in flight at once in each event loop. The repair loop, speculation and
+    streaming bookkeeping are shared with LLMQueryHandler; only the I/O is awaited here.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        vector_store: str,
+        embed_model: str,
+        db_path: str,
+        index_name: str = None,
+        top_k=5,
+        max_rows: int = None,
+        max_concurrency: int = 50,
+        candidates: list[dict] = None,
+        stream_callback: Callable[[str, str], None] = None,
+    ):
+        super().__init__(
+            model,
+            vector_store,
+            embed_model,
+            db_path,
+            index_name,
+            top_k,
+            max_rows,
+            candidates,
+            stream_callback,
+        )
+        self.max_concurrency = max_concurrency
+        # asyncio primitives bind to the first loop that waits on them, so the handler keeps
+        # one semaphore per loop, dropping those of closed loops like llm_clients does
+        self._semaphores: dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+        self._semaphores_lock = threading.Lock()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._semaphores_lock:
+            for closed_loop in [other for other in self._semaphores if other.is_closed()]:
+                del self._semaphores[closed_loop]
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def get_semantic_schemas(self, user_prompt: str) -> list[str]:
+        # Embedding and vector store clients are synchronous, keep them off the event loop
+        return await asyncio.to_thread(super().get_semantic_schemas, user_prompt)
+
+    async def generate_sql_query(
+        self,
+        messages: list[dict],
+        system_prompt: str,
+        model: str = None,
+        temperature: float = None,
+        stream_callback: Callable[[str, str], None] = None,
+        repair: bool = False,
+    ) -> dict:
+        model = model or self.model
+        service = self._find_model(model)
+        if service is None:
+            return None
+        request = self._completion_request(
+            model,
+            messages,
+            system_prompt,
+            temperature,
+            stream=stream_callback is not None,
+            repair=repair,
+        )
+        streamed = StreamedCompletion(service, model, stream_callback) if stream_callback else None
+        if service == "gpt":
+            client = get_async_openai_client(self._api_key(service))
+            response = await client.chat.completions.create(**request)
+        else:
+            client = get_async_anthropic_client(self._api_key(service))
+            response = await client.messages.create(**request)
+
+        if streamed is None:
+            return self._completion_output(service, response)
+        async for event in response:
+            streamed.add(event)
+        return streamed.output()
+
+    async def execute_sql_on_db(
+        self, db_path: str, query: str, params=None
+    ) -> ExecutionResult:
+        return await asyncio.to_thread(super().execute_sql_on_db, db_path, query, params)
+
+    async def _validate_and_execute(self, sql_query: str, schemas) -> ExecutionResult:
+        # Validation opens a pooled SQLite connection, so it is kept off the event loop too
+        return await asyncio.to_thread(
+            self._validate, sql_query, schemas
+        ) or await self.execute_sql_on_db(self.db_path, sql_query)
+
+    async def process_user_query(
+        self,
+        schemas,
+        user_prompt,
+        context,
+        system_prompt,
+        retry_count=0,
+        max_retries=3,
+    ):
+        if retry_count > max_retries:
+            return None, None
+
+        async with self.semaphore:
+            # The result cache and schema fingerprint hit SQLite and the filesystem, so like
+            # query execution they run in worker threads instead of blocking the event loop
+            result_cache = get_result_cache()
+            cache_key, fingerprint = await asyncio.to_thread(
+                self._result_cache_key, schemas, user_prompt, context, system_prompt
+            )
+            cached_output = await asyncio.to_thread(result_cache.get, cache_key, fingerprint)
+            if cached_output is not None:
+                result = await self.execute_sql_on_db(
+                    self.db_path, cached_output["SQL_QUERY"]
+                )
+                if result.error is None:
+                    logger.info(f"Serving SQL Query from Result Cache: {result_cache.stats()}")
+                    return result, self._cache_hit_output(cached_output)
+
+            max_attempts = max_retries - retry_count + 1
+            speculative_output = None
+            if self.candidates:
+                result, speculative_output = await self._generate_speculative(
+                    schemas, user_prompt, context, system_prompt
+                )
+            if speculative_output is None or not self._has_rows(result):
+                if speculative_output is not None:
+                    logger.info("No speculative candidate returned rows. Falling back to repair.")
+                result, output = await self._generate_and_execute(
+                    schemas, user_prompt, context, system_prompt, max_attempts
+                )
+                output = self._with_speculative_attempts(output, speculative_output)
+            else:
+                output = speculative_output
+            if self._has_rows(result):
+                await asyncio.to_thread(result_cache.put, cache_key, output, fingerprint)
+            return result, output
+
+    async def _generate_and_execute(
+        self, schemas, user_prompt, context, system_prompt, max_attempts=1
+    ):
+        # Same RepairLoop as LLMQueryHandler, with the messages local to this call
+        if system_prompt is None:
+            system_prompt = self._create_system_prompt(schemas, context)
+        repair = RepairLoop(
+            self, user_prompt, self._build_initial_messages(system_prompt, user_prompt), max_attempts
+        )
+        while repair.next_attempt():
+            output = await self.generate_sql_query(
+                repair.messages,
+                system_prompt,
+                stream_callback=self.stream_callback,
+                repair=repair.is_repair,
+            )
+            sql_query = output["SQL_QUERY"]
+            repair.record(
+                output,
+                repair.previous_result(sql_query)
+                or await self._validate_and_execute(sql_query, schemas),
+            )
+        return repair.summary()
+
+    async def _generate_speculative(self, schemas, user_prompt, context, system_prompt):
+        # Same Speculation as LLMQueryHandler, with one task per candidate
+        if system_prompt is None:
+            system_prompt = self._create_system_prompt(schemas, context)
+        speculation = Speculation(self, user_prompt, system_prompt)
+
+        async def run_candidate(index: int, candidate: dict) -> bool:
+            model = candidate.get("model", self.model)
+            start = time.perf_counter()
+            try:
+                output = await self.generate_sql_query(
+                    speculation.messages(model), system_prompt, model, candidate.get("temperature")
+                )
+                result = speculation.late_result(output) or await self._validate_and_execute(
+                    output["SQL_QUERY"], schemas
+                )
+            except Exception as e:
+                speculation.fail(index, e)
+                return False
+            # A late candidate is written to the metrics store, off the event loop
+            return await asyncio.to_thread(
+                speculation.finish, index, candidate, output, result, start
+            )
+
+        logger.info(f"Generating {len(self.candidates)} speculative SQL Query candidates")
+        tasks = [
+            asyncio.create_task(run_candidate(index, candidate))
+            for index, candidate in enumerate(self.candidates, start=1)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                if await next_done:
+                    break
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        # Losing candidates still generating finish in the background; the event loop only
+        # keeps weak references to tasks. Those still running when the loop is closed are
+        # cancelled by asyncio, before any usage is known
+        for task in tasks:
+            if not task.done():
+                _late_candidates.add(task)
+                task.add_done_callback(_late_candidates.discard)
+        return speculation.close()
+
+    async def process_user_queries(
+        self, user_prompts: list[str], context: str, system_prompt_template: str
+    ) -> list[tuple[ExecutionResult | None, dict | None]]:
+        """
+        Retrieves schemas for and answers every prompt concurrently, bounded by max_concurrency.
+
+        Parameters:
+        ---
+        user_prompts (list[str]): The questions in natural language.
+        context (str): The context prompt shared by every question.
+        system_prompt_template (str): A template with {schemas} and {context} placeholders,
+            e.g. system_prompt.sys_prompt.
+
+        Returns:
+        ---
+        list[tuple]: One (ExecutionResult, output) pair per prompt, in input order.
+        """
+
+        async def answer(user_prompt: str):
+            schemas = await self.get_semantic_schemas(user_prompt)
+            system_prompt = system_prompt_template.format(
+                schemas="\n\n".join(schemas), context=context
+            )
+            return await self.process_user_query(
+                schemas, user_prompt, context, system_prompt
+            )
+
+        return await asyncio.gather(*(answer(user_prompt) for user_prompt in user_prompts))
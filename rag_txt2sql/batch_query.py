@@ -0,0 +1,300 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from collections import deque
+from typing import Iterable, Iterator
+from itertools import islice
+from functools import partial
+from dotenv import load_dotenv
+import argparse
+import json
+import os
+from query_llm import (
+    HYBRID_RETRIEVAL,
+    SCHEMAS_FILE_PATH,
+    LLMQueryHandler,
+    logger,
+    parse_candidates,
+)
+from lexical_index import get_lexical_index
+from query_vector_database import query_database_batch, get_embed_model
+from embedding_cache import get_embedding_cache
+from embedding_backends import get_query_embedding_batch
+from system_prompt import sys_prompt
+
+load_dotenv()
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def translate_questions(
+    questions: Iterable[str],
+    model: str,
+    vector_store: str,
+    embed_model: str,
+    db_path: str,
+    context: str = "",
+    system_prompt_template: str = sys_prompt,
+    index_name: str = None,
+    top_k: int = 5,
+    embed_batch_size: int = 10,
+    workers: int = 8,
+    chunk_size: int = 200,
+    candidates: list[dict] = None,
+    max_in_flight: int = None,
+) -> Iterator[dict]:
+    """
+    Translates many natural language questions to SQL, yielding one record per question as it completes.
+
+    Questions are consumed chunk_size at a time. Each chunk's schemas are retrieved like
+    LLMQueryHandler.get_semantic_schemas does, with one batched embedding call and vector
+    lookup for the questions the lexical index cannot answer alone. The next chunk is retrieved
+    in the background while the current one is generated, with up to `workers` questions
+    generating and at most max_in_flight submitted. Records are yielded in completion order and
+    carry the input index. Closing the iterator early cancels the questions not yet started.
+
+    Parameters:
+    ---
+    questions (Iterable[str]): The questions in natural language. May be a lazy iterator.
+    model (str): The LLM used to generate SQL.
+    vector_store (str): One of 'pinecone', 'weaviate' or 'local'.
+    embed_model (str): The embedding model used to embed the questions.
+    db_path (str): The SQLite database the SQL is executed against.
+    context (str): The context prompt shared by every question.
+    system_prompt_template (str): A template with {schemas} and {context} placeholders.
+    workers (int): Number of questions generated and executed concurrently.
+    candidates (list[dict]): Optional speculative candidates, see LLMQueryHandler.
+    max_in_flight (int): Maximum questions submitted and not yet yielded, 2 * workers by default.
+
+    Returns:
+    ---
+    Iterator[dict]: Records with the question, SQL, rows, token counts, cost and error.
+    """
+    max_in_flight = max_in_flight or 2 * workers
+    retrieve = partial(
+        _retrieve_schemas,
+        vector_store=vector_store,
+        embed_model=embed_model,
+        db_path=db_path,
+        index_name=index_name,
+        top_k=top_k,
+        embed_batch_size=embed_batch_size,
+    )
+    chunks = _chunks(questions, chunk_size)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, ThreadPoolExecutor(
+        max_workers=1
+    ) as retriever:
+
+        def retrieve_next(offset: int) -> Future | None:
+            chunk = next(chunks, None)
+            return None if chunk is None else retriever.submit(retrieve, offset, chunk)
+
+        retrieving = retrieve_next(0)
+        retrieved: deque[tuple[int, str, list[str]]] = deque()
+        pending: set[Future] = set()
+        try:
+            while True:
+                while len(pending) < max_in_flight:
+                    if not retrieved:
+                        # Only wait on retrieval when there is nothing else to wait on
+                        if retrieving is None or (pending and not retrieving.done()):
+                            break
+                        retrieved.extend(retrieving.result())
+                        retrieving = retrieve_next(retrieved[-1][0] + 1) if retrieved else None
+                        continue
+                    index, question, schemas = retrieved.popleft()
+                    pending.add(
+                        executor.submit(
+                            _translate_question,
+                            index,
+                            question,
+                            schemas,
+                            model,
+                            vector_store,
+                            embed_model,
+                            db_path,
+                            context,
+                            system_prompt_template,
+                            index_name,
+                            top_k,
+                            candidates,
+                        )
+                    )
+                if not pending:
+                    break
+                done, _ = wait(
+                    pending | ({retrieving} if retrieving else set()),
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done & pending:
+                    pending.discard(future)
+                    yield future.result()
+        finally:
+            # Also reached on GeneratorExit when the caller stops iterating; the executors
+            # then only wait for the questions already running
+            for future in pending:
+                future.cancel()
+            if retrieving is not None:
+                retrieving.cancel()
+
+
+def _retrieve_schemas(
+    offset: int,
+    chunk: list[str],
+    vector_store: str,
+    embed_model: str,
+    db_path: str,
+    index_name: str,
+    top_k: int,
+    embed_batch_size: int,
+) -> list[tuple[int, str, list[str]]]:
+    # Batched counterpart of LLMQueryHandler.get_semantic_schemas, before compaction
+    lexical_index = get_lexical_index(SCHEMAS_FILE_PATH, db_path) if HYBRID_RETRIEVAL else None
+    schemas_per_question = [
+        lexical_index.unambiguous_matches(question, top_k) if lexical_index else None
+        for question in chunk
+    ]
+    unmatched = [i for i, schemas in enumerate(schemas_per_question) if schemas is None]
+    if unmatched:
+        queries = [chunk[i] for i in unmatched]
+        query_embeddings = get_embedding_cache().get_or_compute_batch(
+            embed_model,
+            queries,
+            partial(get_query_embedding_batch, get_embed_model(embed_model, embed_batch_size)),
+            embedding_type="query",
+        )
+        nodes_per_question = query_database_batch(
+            queries=queries,
+            query_embeddings=query_embeddings,
+            vector_store=vector_store,
+            embed_model=embed_model,
+            embed_batch_size=embed_batch_size,
+            index_name=index_name,
+            top_k=top_k,
+        )
+        for i, nodes in zip(unmatched, nodes_per_question):
+            schemas = [node.get_text() for node in nodes]
+            if lexical_index is not None:
+                schemas = lexical_index.fuse(chunk[i], schemas, top_k)
+            schemas_per_question[i] = schemas
+    logger.info(
+        f"Retrieved schemas for {len(chunk)} questions, "
+        f"{len(chunk) - len(unmatched)} from lexical matches alone"
+    )
+    return [
+        (offset + i, question, schemas)
+        for i, (question, schemas) in enumerate(zip(chunk, schemas_per_question))
+    ]
+
+
+def _translate_question(
+    index: int,
+    question: str,
+    schemas: list[str],
+    model: str,
+    vector_store: str,
+    embed_model: str,
+    db_path: str,
+    context: str,
+    system_prompt_template: str,
+    index_name: str,
+    top_k: int,
+    candidates: list[dict],
+) -> dict:
+    # Handlers keep per-question conversation state, so every question gets its own
+    handler = LLMQueryHandler(
+        model=model,
+        vector_store=vector_store,
+        embed_model=embed_model,
+        db_path=db_path,
+        index_name=index_name,
+        top_k=top_k,
+        candidates=candidates,
+    )
+    record = {"index": index, "question": question}
+    try:
+        schemas = handler.compact_schemas(schemas)
+        system_prompt = system_prompt_template.format(
+            schemas="\n\n".join(schemas), context=context
+        )
+        result, output = handler.process_user_query(
+            schemas, question, context, system_prompt
+        )
+    except Exception as e:
+        logger.error(f"Failed to translate question {index}: {e}")
+        record.update({"sql": None, "rows": None, "error": str(e)})
+        return record
+
+    if output is None:
+        record.update({"sql": None, "rows": None, "error": "No SQL query generated."})
+        return record
+
+    n_prompt_tokens = output.get("N_PROMPT_TOKENS", 0)
+    n_generated_tokens = output.get("N_GENERATED_TOKENS", 0)
+    record.update(
+        {
+            "model": output.get("MODEL"),
+            "sql": output.get("SQL_QUERY"),
+            "rows": None if result.df is None else result.df.to_dict(orient="records"),
+            "n_rows": result.n_rows,
+            "execution_seconds": result.elapsed_seconds,
+            "n_prompt_tokens": n_prompt_tokens,
+            "n_generated_tokens": n_generated_tokens,
+            "n_cached_tokens": output.get("N_CACHED_TOKENS", 0),
+            "n_cache_write_tokens": output.get("N_CACHE_WRITE_TOKENS", 0),
+            "cost": output.get("COST", 0.0),
+            "error": result.error,
+        }
+    )
+    return record
+
+
+def write_jsonl(records: Iterable[dict], output_path: str) -> int:
+    """
+    Streams records to output_path as JSON lines, flushing after each one. Returns the count written.
+    """
+    n_records = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, default=str) + "\n")
+            f.flush()
+            n_records += 1
+    return n_records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Translate a file of questions (one per line) to SQL as JSON lines."
+    )
+    parser.add_argument("questions_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    CONTEXT_PROMPT_FILE_PATH = os.environ.get("CONTEXT_PROMPT_FILE_PATH")
+    try:
+        with open(CONTEXT_PROMPT_FILE_PATH) as f:
+            context_prompt = f.read()
+    except Exception:
+        context_prompt = ""
+
+    with open(args.questions_file, "r", encoding="utf-8") as f:
+        questions = (line.strip() for line in f if line.strip())
+        n_records = write_jsonl(
+            translate_questions(
+                questions,
+                model=os.environ.get("GPT_MODEL"),
+                vector_store=os.environ.get("VECTOR_STORE"),
+                embed_model=os.environ.get("EMBED_MODEL"),
+                db_path=os.environ.get("DB_PATH", "patient_health_data.db"),
+                context=context_prompt,
+                embed_batch_size=int(os.environ.get("EMBED_BATCH_SIZE", "10")),
+                workers=args.workers,
+                candidates=parse_candidates(os.environ.get("LLM_CANDIDATES")),
+            ),
+            args.output_file,
+        )
+    print(f"Wrote {n_records} results to {args.output_file}")
@@ -4,29 +4,217 @@ from llama_index.core.ingestion import IngestionPipeline
 from llama_index.vector_stores.pinecone import PineconeVectorStore
 from llama_index.vector_stores.weaviate import WeaviateVectorStore
 from llama_index.core import VectorStoreIndex
-from llama_index.embeddings.openai import OpenAIEmbedding
+from llama_index.core.base.embeddings.base import BaseEmbedding
 from pinecone import Pinecone, ServerlessSpec
 import weaviate
+from itertools import islice
+from typing import Callable, Iterable, Iterator
 import re
+import json
+import uuid
 from dotenv import load_dotenv
 import os
-from utils import check_valid_vector_store
+from utils import check_valid_vector_store, get_text_hash, sanitize_filename
+from query_vector_database import invalidate_retrievers, get_embed_model, DEFAULT_INDEX_NAMES
+from embedding_backends import parse_embed_model, OPENAI_BACKEND
+from local_vector_store import LocalSchemaIndex, get_local_index_dir
+from parallel_embedding import RateLimitedOpenAIEmbedding
+
+try:
+    from utils import setup_logger
+
+    logger = setup_logger(__name__)
+except Exception:
+    import logging
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+SCHEMA_DELIMITER = "&"
+
+
 class SchemaParser(TransformComponent):
     def __call__(self, docs: list[Document], **kwargs) -> list[Document]:
         processed_docs = []
         for doc in docs:
-            schemas = doc.text.split("&")
-            for schema in schemas:
-                matched_string = re.search(r"CREATE TABLE (\w+)", schema)
-                if matched_string:
-                    title = matched_string.group(1)
-                processed_doc = Document(text=schema, extra_info={"title": title})
-                processed_docs.append(processed_doc)
+            for schema in doc.text.split(SCHEMA_DELIMITER):
+                processed_doc = self.parse_schema(schema)
+                if processed_doc is not None:
+                    processed_docs.append(processed_doc)
         return processed_docs
 
+    @staticmethod
+    def parse_schema(schema: str) -> Document | None:
+        """
+        Turns one delimited schema chunk into a Document, or None if the chunk is blank.
+        Chunks without a CREATE TABLE are keyed by their content hash instead of a title.
+        """
+        if not schema.strip():
+            return None
+        schema_hash = get_text_hash(schema)
+        matched_string = re.search(r"CREATE TABLE (\w+)", schema)
+        title = matched_string.group(1) if matched_string else None
+        # Stable ids and content hashes let ingestion skip tables that did not change
+        return Document(
+            id_=schema_node_id(title or schema_hash),
+            text=schema,
+            extra_info={"title": title or "", "schema_hash": schema_hash},
+            excluded_embed_metadata_keys=["schema_hash"],
+            excluded_llm_metadata_keys=["schema_hash"],
+        )
+
+    def iter_file(self, file_path: str, read_size: int = 1 << 20) -> Iterator[Document]:
+        """
+        Streams one Document per table from a schema dump, reading read_size characters at a
+        time, so memory stays bounded by the largest single schema rather than the file.
+        """
+        buffer = ""
+        with open(file_path, "r", encoding="utf-8") as f:
+            while chunk := f.read(read_size):
+                buffer += chunk
+                *schemas, buffer = buffer.split(SCHEMA_DELIMITER)
+                for schema in schemas:
+                    processed_doc = self.parse_schema(schema)
+                    if processed_doc is not None:
+                        yield processed_doc
+        processed_doc = self.parse_schema(buffer)
+        if processed_doc is not None:
+            yield processed_doc
+
+
+def schema_node_id(title: str) -> str:
+    # A UUID, since Weaviate requires object ids to be UUIDs
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"schema:{title}"))
+
+
+def get_schema_manifest_path(vector_store_name: str, index_name: str) -> str:
+    INGESTION_STATE_DIR = os.environ.get("INGESTION_STATE_DIR", "ingestion_state")
+    return os.path.join(
+        INGESTION_STATE_DIR, f"{vector_store_name}-{sanitize_filename(index_name)}.json"
+    )
+
+
+def get_embedding_checkpoint_path(manifest_path: str) -> str:
+    return os.path.splitext(manifest_path)[0] + ".checkpoint.jsonl"
+
+
+def build_ingestion_embedding(
+    model: str, openai_api_key: str, embed_batch_size: int, checkpoint_path: str
+) -> BaseEmbedding:
+    """
+    Embedding model for ingestion. OpenAI models run EMBED_CONCURRENCY batches in flight under
+    the EMBED_RPM and EMBED_TPM quotas, checkpointed to checkpoint_path so an interrupted run
+    can resume. Local models (EMBED_MODEL=local:...) share the warm query-time instance.
+    """
+    backend, model_name = parse_embed_model(model)
+    if backend != OPENAI_BACKEND:
+        return get_embed_model(model, embed_batch_size)
+    if openai_api_key is None:
+        raise ValueError("OPENAI_API_KEY must be specified as an environment variable.")
+    return RateLimitedOpenAIEmbedding(
+        model_name=model_name,
+        api_key=openai_api_key,
+        embed_batch_size=embed_batch_size,
+        max_workers=int(os.environ.get("EMBED_CONCURRENCY", "4")),
+        requests_per_minute=int(os.environ.get("EMBED_RPM", "3000")),
+        tokens_per_minute=int(os.environ.get("EMBED_TPM", "1000000")),
+        max_retries=int(os.environ.get("EMBED_MAX_RETRIES", "6")),
+        checkpoint_path=checkpoint_path,
+    )
+
+
+def get_embedding_signature(model: str, embed_model: BaseEmbedding) -> dict:
+    """
+    The embedding model name and vector dimension an index is built with. Vectors from a
+    different signature cannot be mixed into it, so a mismatch forces a full refresh.
+    """
+    return {
+        "embed_model": model,
+        "dimension": len(embed_model.get_text_embedding("dimension probe")),
+    }
+
+
+def signature_matches(stored: dict, signature: dict) -> bool:
+    matches = all(stored.get(key) == value for key, value in signature.items())
+    if not matches:
+        logger.info(
+            f"Index was built with {stored.get('embed_model')!r} "
+            f"(dimension {stored.get('dimension')}), not {signature['embed_model']!r} "
+            f"(dimension {signature['dimension']}); re-embedding every table"
+        )
+    return matches
+
+
+def load_schema_manifest(path: str) -> dict:
+    """
+    Returns {"embed_model", "dimension", "schemas": {node id: schema hash}}, or {} when there
+    is no manifest. Manifests written before the embedding signature was recorded only hold
+    the schemas, so they never match a signature.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if "schemas" not in manifest:
+        manifest = {"schemas": manifest}
+    return manifest
+
+
+def save_schema_manifest(path: str, schemas: dict[str, str], signature: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({**signature, "schemas": schemas}, f, indent=2, sort_keys=True)
+
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def ingest_schema_file(
+    file_path: str,
+    manifest: dict[str, str],
+    ingest: Callable[[list[Document]], None],
+    batch_size: int = 256,
+) -> tuple[dict[str, str], list[str]]:
+    """
+    Streams the schema file through SchemaParser in batches of batch_size documents and calls
+    ingest() with the new or changed documents of each batch, compared with the manifest
+    (node id -> schema hash) of what is already indexed.
+
+    Returns:
+    ---
+    tuple: The manifest of the file as ingested, and the node ids of tables that were removed.
+    """
+    current = {}
+    n_changed = 0
+    for batch in _batches(SchemaParser().iter_file(file_path), batch_size):
+        changed = [
+            doc for doc in batch if manifest.get(doc.doc_id) != doc.metadata["schema_hash"]
+        ]
+        current.update({doc.doc_id: doc.metadata["schema_hash"] for doc in batch})
+        if changed:
+            ingest(changed)
+            n_changed += len(changed)
+    removed = [node_id for node_id in manifest if node_id not in current]
+    logger.info(f"Schemas embedded: {n_changed}, removed: {len(removed)}, total: {len(current)}")
+    return current, removed
+
+
+def delete_schema_nodes(vector_store_name: str, vector_store, node_ids: list[str]):
+    if not node_ids:
+        return
+    if vector_store_name == "pinecone":
+        vector_store.client.delete(ids=node_ids)
+    elif vector_store_name == "weaviate":
+        for node_id in node_ids:
+            vector_store.client.data_object.delete(
+                uuid=node_id, class_name=vector_store.index_name
+            )
+
 
 def check_weaviate_vector_store_exists(client: weaviate.Client, vector_store_name: str):
     schema = client.schema.get()
@@ -42,8 +230,12 @@ def initialize_vector_store(
     pinecone_api_key: str,
     pinecone_config: dict,
     index_name: str = None,
+    reset: bool = False,
 ) -> WeaviateVectorStore | PineconeVectorStore:
-   
+    """
+    Connects to the vector store, creating it if needed. reset=True empties an existing store,
+    for a full rebuild when there is no ingestion manifest describing its contents.
+    """
 
     WEAVIATE_HOST = os.environ.get("WEAVIATE_HOST")
 
@@ -53,12 +245,10 @@ def initialize_vector_store(
 
         client = weaviate.Client(url=WEAVIATE_HOST)
 
-        if not check_weaviate_vector_store_exists(client, index_name):
-            vector_store = WeaviateVectorStore(
-                weaviate_client=client, index_name=index_name
-            )
-        else:
-            return False
+        if reset and check_weaviate_vector_store_exists(client, index_name):
+            client.schema.delete_class(index_name)
+        # Existing classes are reused so changed schemas can be upserted into them
+        vector_store = WeaviateVectorStore(weaviate_client=client, index_name=index_name)
         # logger.info(f"Created {vector_store_name} vector store")
 
     elif vector_store_name == "pinecone":
@@ -96,6 +286,8 @@ def initialize_vector_store(
         else:
             # logger.info("Vector Index Already Exists")
             pc_index = pc.Index(name=index_name)
+            if reset:
+                pc_index.delete(delete_all=True)
 
         vector_store = PineconeVectorStore(
             pinecone_index=pc_index,
@@ -106,6 +298,66 @@ def initialize_vector_store(
     return vector_store
 
 
+def create_local_database(
+    file_path: str,
+    model: str,
+    openai_api_key: str,
+    embed_batch_size: int,
+    index_name: str = None,
+    ingest_batch_size: int = 256,
+) -> LocalSchemaIndex:
+    """
+    Embeds the new or changed schemas in file_path and saves the index as a local float32
+    matrix on disk. Unchanged tables keep their stored embeddings; removed tables are dropped.
+    """
+    if index_name is None:
+        index_name = "schema-index"
+    index_dir = get_local_index_dir(index_name)
+
+    embed_model = build_ingestion_embedding(
+        model,
+        openai_api_key,
+        embed_batch_size,
+        get_embedding_checkpoint_path(get_schema_manifest_path("local", index_name)),
+    )
+    signature = get_embedding_signature(model, embed_model)
+
+    try:
+        existing = LocalSchemaIndex.load(index_dir, mmap=False)
+    except FileNotFoundError:
+        existing = None
+    if existing is not None and not signature_matches(existing.metadata, signature):
+        existing = None
+    # The local index is its own manifest: every document carries its schema hash
+    manifest = {
+        document["id"]: document["metadata"].get("schema_hash")
+        for document in (existing.documents if existing else [])
+    }
+
+    # No vector_store: the pipeline hands back the embedded nodes instead of upserting them
+    pipeline = IngestionPipeline(transformations=[embed_model])
+    nodes = []
+    _, removed = ingest_schema_file(
+        file_path,
+        manifest,
+        lambda changed: nodes.extend(pipeline.run(documents=changed)),
+        ingest_batch_size,
+    )
+
+    if existing is None:
+        index = LocalSchemaIndex.from_nodes(nodes)
+    else:
+        index = existing.upsert(nodes, removed)
+    index.metadata = signature
+    index.save(index_dir)
+    if isinstance(embed_model, RateLimitedOpenAIEmbedding):
+        embed_model.remove_checkpoint()
+
+    invalidate_retrievers("local", index_name)
+
+    return index
+
+
 def create_database(
     file_path: str,
     vector_store_name: str,
@@ -113,54 +365,77 @@ def create_database(
     embed_batch_size: int,
     pinecone_config: dict = None,
     index_name: str = None,
-) -> VectorStoreIndex:
-
+    full_refresh: bool = False,
+    ingest_batch_size: int = 256,
+) -> VectorStoreIndex | LocalSchemaIndex:
+    """
+    Ingests the schemas in file_path incrementally: only new or changed tables (by content
+    hash) are embedded and upserted, and removed tables are deleted. For Pinecone and Weaviate
+    the hashes of what was ingested are kept in a manifest under INGESTION_STATE_DIR;
+    without one, with full_refresh=True, or when the embedding model or dimension differ from
+    the ones recorded, the store is emptied and rebuilt.
+
+    The file is streamed and ingested ingest_batch_size tables at a time, so peak memory does
+    not grow with the size of the schema dump.
+    """
 
     if not check_valid_vector_store(vector_store_name):
         raise ValueError(
-            f"{vector_store_name} is  not supported. Currently supported: 'pinecone' or 'weaviate'"
+            f"{vector_store_name} is  not supported. Currently supported: 'pinecone', 'weaviate' or 'local'"
         )
 
     pinecone_api_key = os.environ.get("PINECONE_API_KEY")
-    if pinecone_api_key is None:
+    if pinecone_api_key is None and vector_store_name == "pinecone":
         raise ValueError(
             "PINECONE_API_KEY must be specified as an environment variable."
         )
     openai_api_key = os.environ.get("OPENAI_API_KEY")
-    if openai_api_key is None:
-        raise ValueError("OPENAI_API_KEY must be specified as an environment variable.")
 
+    if vector_store_name == "local":
+        return create_local_database(
+            file_path, model, openai_api_key, embed_batch_size, index_name, ingest_batch_size
+        )
+
+    manifest_path = get_schema_manifest_path(
+        vector_store_name, index_name or DEFAULT_INDEX_NAMES[vector_store_name]
+    )
+    embed_model = build_ingestion_embedding(
+        model,
+        openai_api_key,
+        embed_batch_size,
+        get_embedding_checkpoint_path(manifest_path),
+    )
+    signature = get_embedding_signature(model, embed_model)
+    stored = {} if full_refresh else load_schema_manifest(manifest_path)
+    manifest = stored["schemas"] if stored and signature_matches(stored, signature) else {}
     vector_store = initialize_vector_store(
-        vector_store_name, pinecone_api_key, pinecone_config, index_name
+        vector_store_name,
+        pinecone_api_key,
+        pinecone_config,
+        index_name,
+        reset=not manifest,
     )
-    if vector_store:
-        # Data Ingestion Into Vector Store
-        pipeline = IngestionPipeline(
-            transformations=[
-                SchemaParser(),
-                OpenAIEmbedding(
-                    model=model,
-                    api_key=openai_api_key,
-                    embed_batch_size=embed_batch_size,
-                ),
-            ],
-            vector_store=vector_store,
-        )
 
-        with open(
-            file_path,
-            "r",
-        ) as f:
-            text = f.read()
+    # Data Ingestion Into Vector Store. Node ids are stable, so changed tables overwrite
+    # their previous vectors in place
+    pipeline = IngestionPipeline(transformations=[embed_model], vector_store=vector_store)
+    ingested, removed = ingest_schema_file(
+        file_path,
+        manifest,
+        lambda changed: pipeline.run(documents=changed),
+        ingest_batch_size,
+    )
+    delete_schema_nodes(vector_store_name, vector_store, removed)
+    save_schema_manifest(manifest_path, ingested, signature)
+    if isinstance(embed_model, RateLimitedOpenAIEmbedding):
+        embed_model.remove_checkpoint()
 
-        initial_docs = [Document(text=text)]
-        docs = pipeline.run(documents=initial_docs)
+    # Retrievers cached by query_vector_database must not keep serving the old index
+    invalidate_retrievers(vector_store_name, index_name)
 
-        index = VectorStoreIndex.from_vector_store(vector_store)
+    index = VectorStoreIndex.from_vector_store(vector_store)
 
-        return index
-    else:
-        return None
+    return index
 
 
 if __name__ == "__main__":
@@ -172,7 +447,8 @@ if __name__ == "__main__":
     vector_store_name = os.environ.get("VECTOR_STORE", "weaviate")
     pinecone_config = {
         "metric": "cosine",
-        "dimension": 1536,
+        # text-embedding-3-small; set EMBED_DIMENSION for other models, e.g. 384 for bge-small
+        "dimension": int(os.environ.get("EMBED_DIMENSION", "1536")),
         "cloud": "aws",
         "region": os.environ.get("PINECONE_REGION", "us-east-1"),
     }
@@ -180,5 +456,11 @@ if __name__ == "__main__":
     model = os.environ.get("EMBED_MODEL", "text-embedding-3-small")
 
     index = create_database(
-        file_path, vector_store_name, model, embed_batch_size, pinecone_config
+        file_path,
+        vector_store_name,
+        model,
+        embed_batch_size,
+        pinecone_config,
+        full_refresh=os.environ.get("FULL_REFRESH", "0") == "1",
+        ingest_batch_size=int(os.environ.get("INGEST_BATCH_SIZE", "256")),
     )
@@ -0,0 +1,99 @@
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from dotenv import load_dotenv
+import os
+
+try:
+    from utils import setup_logger
+
+    logger = setup_logger(__name__)
+except Exception:
+    import logging
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+OPENAI_BACKEND = "openai"
+HUGGINGFACE_BACKEND = "huggingface"
+
+# EMBED_MODEL prefixes that select a backend; a bare model name is an OpenAI model
+_BACKEND_PREFIXES = {
+    "openai": OPENAI_BACKEND,
+    "local": HUGGINGFACE_BACKEND,
+    "hf": HUGGINGFACE_BACKEND,
+    "huggingface": HUGGINGFACE_BACKEND,
+}
+
+
+def parse_embed_model(embed_model: str) -> tuple[str, str]:
+    """
+    Splits an EMBED_MODEL value such as 'local:BAAI/bge-small-en-v1.5' or
+    'text-embedding-3-small' into (backend, model name).
+    """
+    prefix, separator, model_name = embed_model.partition(":")
+    if separator and prefix.lower() in _BACKEND_PREFIXES:
+        return _BACKEND_PREFIXES[prefix.lower()], model_name
+    return OPENAI_BACKEND, embed_model
+
+
+def build_huggingface_embedding(model_name: str, embed_batch_size: int = 32) -> BaseEmbedding:
+    """
+    Loads a sentence-transformer for CPU inference. The model runs one warm-up encode so the
+    first question does not pay for it.
+    """
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    model = HuggingFaceEmbedding(
+        model_name=model_name,
+        embed_batch_size=embed_batch_size,
+        device=os.environ.get("EMBED_DEVICE", "cpu"),
+        cache_folder=os.environ.get("EMBED_CACHE_FOLDER"),
+    )
+    model.get_query_embedding("warm up")
+    logger.info(f"Loaded local embedding model {model_name}")
+    return model
+
+
+def build_embed_model(embed_model: str, embed_batch_size: int = 10) -> BaseEmbedding:
+    """
+    Builds the query embedding model for an EMBED_MODEL value.
+
+    Parameters:
+    ---
+    embed_model (str): An OpenAI embedding model name, or 'local:<sentence-transformer>' for
+        a model run in-process on CPU with no network calls.
+    embed_batch_size (int): Texts per embedding call or inference batch.
+
+    Returns:
+    ---
+    BaseEmbedding: A llama-index embedding model.
+    """
+    backend, model_name = parse_embed_model(embed_model)
+    if backend == HUGGINGFACE_BACKEND:
+        return build_huggingface_embedding(model_name, embed_batch_size)
+
+    from llama_index.embeddings.openai import OpenAIEmbedding
+
+    openai_api_key = os.environ.get("OPENAI_API_KEY")
+    if openai_api_key is None:
+        raise ValueError("OPENAI_API_KEY must be specified as an environment variable.")
+    return OpenAIEmbedding(
+        model=model_name,
+        embed_batch_size=embed_batch_size,
+        api_key=openai_api_key,
+    )
+
+
+def get_query_embedding_batch(model: BaseEmbedding, queries: list[str]) -> list[list[float]]:
+    """
+    Embeds questions as search queries.
+
+    BaseEmbedding has no batched query call. OpenAI models embed queries and documents with the
+    same engine, so their queries go through one batched call; other models may add a query
+    instruction (e.g. bge), so each query is embedded with get_query_embedding.
+    """
+    query_engine = getattr(model, "_query_engine", None)
+    if query_engine is not None and query_engine == getattr(model, "_text_engine", None):
+        return model.get_text_embedding_batch(queries)
+    return [model.get_query_embedding(query) for query in queries]
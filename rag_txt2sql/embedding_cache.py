@@ -0,0 +1,163 @@
+from dotenv import load_dotenv
+from array import array
+from typing import Callable
+import hashlib
+import sqlite3
+import threading
+import time
+import re
+import os
+
+load_dotenv()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalises a question so trivially different phrasings share one cache entry.
+    """
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip("?.! ")
+
+
+class EmbeddingCache:
+    """
+    Disk-backed LRU cache of embeddings keyed on (embed_model, embedding type, normalised
+    text). Query and document embeddings of the same text differ for models with query
+    instructions, so the type ("query" or "text") is part of the key.
+
+    Entries live in a SQLite table so they survive restarts and are shared by every process
+    pointing at the same file. Once max_entries is exceeded the least recently used entries
+    are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                text TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def _make_key(model: str, text: str, embedding_type: str) -> str:
+        return hashlib.sha256(
+            f"{model}\x00{embedding_type}\x00{normalize_text(text)}".encode("utf-8")
+        ).hexdigest()
+
+    def get(self, model: str, text: str, embedding_type: str = "query") -> list[float] | None:
+        key = self._make_key(model, text, embedding_type)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT embedding FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._connection.commit()
+        return array("f", row[0]).tolist()
+
+    def put(
+        self, model: str, text: str, embedding: list[float], embedding_type: str = "query"
+    ):
+        key = self._make_key(model, text, embedding_type)
+        blob = array("f", embedding).tobytes()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO embeddings (key, model, text, embedding, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, normalize_text(text), blob, time.time()),
+            )
+            self._connection.execute(
+                """
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            self._connection.commit()
+
+    def get_or_compute(
+        self,
+        model: str,
+        text: str,
+        compute: Callable[[str], list[float]],
+        embedding_type: str = "query",
+    ) -> list[float]:
+        """
+        Returns the cached embedding for text, calling compute(text) and storing the result on a miss.
+        """
+        embedding = self.get(model, text, embedding_type)
+        if embedding is None:
+            embedding = compute(text)
+            self.put(model, text, embedding, embedding_type)
+        return embedding
+
+    def get_or_compute_batch(
+        self,
+        model: str,
+        texts: list[str],
+        compute_batch: Callable[[list[str]], list[list[float]]],
+        embedding_type: str = "query",
+    ) -> list[list[float]]:
+        """
+        Batch version of get_or_compute: every miss is embedded with a single compute_batch call.
+        """
+        embeddings = [self.get(model, text, embedding_type) for text in texts]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = compute_batch([texts[i] for i in missing])
+            for i, embedding in zip(missing, computed):
+                self.put(model, texts[i], embedding, embedding_type)
+                embeddings[i] = embedding
+        return embeddings
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM embeddings")
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            (size,) = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Returns the process-wide embedding cache configured by EMBEDDING_CACHE_PATH and
+    EMBEDDING_CACHE_MAX_ENTRIES.
+    """
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                path=os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3"),
+                max_entries=int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "10000")),
+            )
+    return _embedding_cache
@@ -0,0 +1,260 @@
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+import threading
+import math
+import re
+import os
+from schema_compaction import parse_create_table
+from result_cache import compute_schema_fingerprint
+from sql_engine import get_engine
+
+try:
+    from utils import setup_logger
+
+    logger = setup_logger(__name__)
+except Exception:
+    import logging
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+# A table-name match counts this many times more than a column or comment match
+TABLE_NAME_WEIGHT = 3.0
+# Tables ranked next to the named ones when they score at least this share of the weakest one
+LEXICAL_SCORE_RATIO = 0.25
+# Reciprocal rank fusion constant, as in Cormack et al.
+RRF_K = 60
+
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+# Question words that describe the aggregation rather than the data, so they never have to be
+# found in a table for the lexical shortcut
+_QUERY_WORDS = {
+    "average", "count", "distinct", "first", "group", "highest", "last", "latest", "least",
+    "lowest", "max", "maximum", "min", "minimum", "most", "number", "often", "percent",
+    "percentage", "recent", "recently", "sum", "top", "total",
+}
+
+_STOPWORDS = {
+    "a", "all", "an", "and", "any", "are", "as", "at", "be", "by", "can", "do", "does",
+    "each", "for", "from", "give", "have", "how", "i", "in", "is", "it", "list", "many",
+    "me", "much", "of", "on", "or", "per", "show", "that", "the", "their", "there", "to",
+    "was", "were", "what", "when", "where", "which", "who", "with", "within", "our",
+}
+
+
+def _stem(token: str) -> str:
+    # Plural folding is enough to match "allergies" to allergy and "patients" to patient
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lower-cased, plural-folded words of text, splitting snake_case and camelCase identifiers.
+    """
+    words = re.findall(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+", text)
+    return [_stem(word.lower()) for word in words if word.lower() not in _STOPWORDS]
+
+
+def _whole_name(identifier: str) -> str:
+    return _stem(re.sub(r"[^a-z0-9]", "", identifier.lower()))
+
+
+def _identifier_terms(identifier: str) -> list[str]:
+    # The words of an identifier plus the whole name, so "care plans" can match careplans
+    return list(dict.fromkeys(tokenize(identifier) + [_whole_name(identifier)]))
+
+
+def _query_terms(text: str) -> list[str]:
+    tokens = tokenize(text)
+    # Adjacent words joined, for table names written as one word
+    return tokens + [_stem(a + b) for a, b in zip(tokens, tokens[1:])]
+
+
+@dataclass
+class SchemaDocument:
+    """
+    One table of the lexical index: its name, the schema text handed to the LLM, the
+    whole-name term that identifies it in a question, and every term of its name, columns and
+    comments.
+    """
+
+    title: str
+    text: str
+    name_term: str
+    terms: frozenset[str]
+
+
+class _Field:
+    """
+    BM25 postings for one field (table names, or columns and comments) of every document.
+    """
+
+    def __init__(self, documents_terms: list[Counter]):
+        self.postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+        for doc_id, terms in enumerate(documents_terms):
+            for term, tf in terms.items():
+                self.postings[term].append((doc_id, tf))
+        self.lengths = [sum(terms.values()) for terms in documents_terms]
+        self.avg_length = sum(self.lengths) / max(len(self.lengths), 1) or 1.0
+
+    def score(self, terms: list[str], scores: dict[int, float], weight: float = 1.0):
+        n_documents = len(self.lengths)
+        for term in set(terms):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log((n_documents - len(postings) + 0.5) / (len(postings) + 0.5) + 1)
+            for doc_id, tf in postings:
+                norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * self.lengths[doc_id] / self.avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * idf * tf * (
+                    _BM25_K1 + 1
+                ) / (tf + norm)
+
+
+class SchemaLexicalIndex:
+    """
+    Inverted index over table names, column names and SQL comments of the schema catalog,
+    scored with BM25 and the table-name field weighted TABLE_NAME_WEIGHT times higher.
+
+    Questions usually name the tables they are about, so a lexical match can stand in for
+    the embedding call entirely, and otherwise sharpens the vector ranking through
+    reciprocal rank fusion.
+    """
+
+    def __init__(self, schemas: list[str]):
+        self.documents: list[SchemaDocument] = []
+        name_terms, body_terms = [], []
+        for schema in schemas:
+            parsed = parse_create_table(schema)
+            if parsed is None:
+                continue
+            title, columns, _ = parsed
+            body = Counter()
+            for _, column_name, *_ in columns:
+                body.update(_identifier_terms(column_name))
+            for comment in re.findall(r"--(.*)$|/\*(.*?)\*/", schema, re.M | re.S):
+                body.update(tokenize(" ".join(comment)))
+            names = Counter(_identifier_terms(title))
+            self.documents.append(
+                SchemaDocument(title, schema.strip(), _whole_name(title), frozenset(names | body))
+            )
+            name_terms.append(names)
+            body_terms.append(body)
+        self._names = _Field(name_terms)
+        self._body = _Field(body_terms)
+
+    @classmethod
+    def from_schema_file(cls, file_path: str) -> "SchemaLexicalIndex":
+        with open(file_path, "r", encoding="utf-8") as f:
+            return cls(f.read().split("&"))
+
+    @classmethod
+    def from_sqlite(cls, db_path: str) -> "SchemaLexicalIndex":
+        with get_engine(db_path).connection() as connection:
+            rows = connection.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND sql IS NOT NULL "
+                "AND name NOT LIKE 'sqlite_%'"
+            ).fetchall()
+        return cls([sql for (sql,) in rows])
+
+    def search(self, query: str) -> list[tuple[SchemaDocument, float]]:
+        """
+        Every document matching a term of query, best BM25 score first.
+        """
+        terms = _query_terms(query)
+        scores: dict[int, float] = {}
+        self._names.score(terms, scores, TABLE_NAME_WEIGHT)
+        self._body.score(terms, scores)
+        ranking = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [(self.documents[doc_id], score) for doc_id, score in ranking]
+
+    def unambiguous_matches(self, query: str, top_k: int) -> list[str] | None:
+        """
+        Returns the schemas for query when the question names between 1 and top_k tables,
+        followed by tables scoring at least LEXICAL_SCORE_RATIO of the weakest named one (e.g.
+        through a column name), up to top_k.
+
+        Returns None, so the vector store is consulted, when no table or more than top_k
+        tables are named, or when a content word of the question is not found in the names,
+        columns or comments of the returned tables: "How many patients have diabetes?" names
+        patients but needs conditions, which only the vector search can find.
+        """
+        terms = set(_query_terms(query))
+        ranking = self.search(query)
+        named = [(document, score) for document, score in ranking if document.name_term in terms]
+        if not named or len(named) > top_k:
+            return None
+        floor = LEXICAL_SCORE_RATIO * min(score for _, score in named)
+        related = [
+            (document, score)
+            for document, score in ranking
+            if document.name_term not in terms and score >= floor
+        ]
+        matches = [document for document, _ in (named + related)[:top_k]]
+
+        covered_terms = frozenset().union(*(document.terms for document in matches))
+        tokens = tokenize(query)
+        covered = [token in covered_terms for token in tokens]
+        for i in range(len(tokens) - 1):
+            # "care plans" is covered by careplans as a whole
+            if _stem(tokens[i] + tokens[i + 1]) in covered_terms:
+                covered[i] = covered[i + 1] = True
+        for token, is_covered in zip(tokens, covered):
+            if not is_covered and token not in _QUERY_WORDS and not token.isdigit():
+                return None
+        return [document.text for document in matches]
+
+    def fuse(self, query: str, vector_schemas: list[str], top_k: int) -> list[str]:
+        """
+        Merges the vector store's ranking with the lexical one by reciprocal rank fusion and
+        returns the top_k schemas. Vector results keep the text the vector store returned.
+        """
+
+        def key(schema: str) -> str:
+            match = re.search(r"CREATE\s+TABLE\s+[\"`\[]?(\w+)", schema, re.I)
+            return match.group(1).lower() if match else " ".join(schema.split())
+
+        texts, scores = {}, defaultdict(float)
+        lexical_schemas = [document.text for document, _ in self.search(query)]
+        for ranking in (vector_schemas, lexical_schemas):
+            for rank, schema in enumerate(ranking):
+                texts.setdefault(key(schema), schema)
+                scores[key(schema)] += 1 / (RRF_K + rank + 1)
+        fused = sorted(scores, key=lambda schema_key: scores[schema_key], reverse=True)
+        return [texts[schema_key] for schema_key in fused[:top_k]]
+
+
+_lexical_indexes: dict[tuple, tuple[str, SchemaLexicalIndex | None]] = {}
+_lexical_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(schemas_file_path: str, db_path: str) -> SchemaLexicalIndex | None:
+    """
+    Returns the process-wide lexical index built from schemas_file_path, or from the database's
+    sqlite_master when the file does not exist. It is rebuilt whenever the schema fingerprint
+    changes, and None is returned when no table could be indexed.
+    """
+    key = (schemas_file_path, db_path)
+    fingerprint = compute_schema_fingerprint(db_path, schemas_file_path)
+    with _lexical_indexes_lock:
+        cached = _lexical_indexes.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        try:
+            if schemas_file_path and os.path.exists(schemas_file_path):
+                index = SchemaLexicalIndex.from_schema_file(schemas_file_path)
+            else:
+                index = SchemaLexicalIndex.from_sqlite(db_path)
+        except Exception as e:
+            logger.warning(f"Could not build the lexical schema index: {e}")
+            index = None
+        if index is not None and not index.documents:
+            index = None
+        _lexical_indexes[key] = (fingerprint, index)
+        return index
@@ -0,0 +1,149 @@
+from openai import OpenAI, AsyncOpenAI
+from dotenv import load_dotenv
+import anthropic
+import asyncio
+import httpx
+import threading
+import os
+
+load_dotenv()
+
+# One client per (provider, api key, base url) for the whole process. Every client owns an
+# httpx connection pool, so reusing it keeps TLS connections alive across calls and retries.
+_clients: dict[tuple, OpenAI | anthropic.Anthropic] = {}
+_clients_lock = threading.Lock()
+# httpx async clients are bound to the event loop that created them, so async clients are
+# pooled per loop. Clients of loops that have since closed (e.g. after asyncio.run returns)
+# are dropped the next time a client is requested.
+_async_clients: dict[
+    asyncio.AbstractEventLoop, dict[tuple, AsyncOpenAI | anthropic.AsyncAnthropic]
+] = {}
+_async_clients_lock = threading.Lock()
+
+
+def _pool_settings() -> tuple[httpx.Limits, httpx.Timeout]:
+    pool_size = int(os.environ.get("LLM_POOL_SIZE", "20"))
+    timeout = float(os.environ.get("LLM_TIMEOUT", "60"))
+    connect_timeout = float(os.environ.get("LLM_CONNECT_TIMEOUT", "5"))
+    keepalive_expiry = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "60"))
+
+    limits = httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=keepalive_expiry,
+    )
+    return limits, httpx.Timeout(timeout, connect=connect_timeout)
+
+
+def _build_http_client() -> httpx.Client:
+    limits, timeout = _pool_settings()
+    return httpx.Client(limits=limits, timeout=timeout)
+
+
+def _build_async_http_client() -> httpx.AsyncClient:
+    limits, timeout = _pool_settings()
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+def _get_client(provider: str, api_key: str, base_url: str = None):
+    key = (provider, api_key, base_url)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # base_url=None lets each SDK fall back to OPENAI_BASE_URL / ANTHROPIC_BASE_URL,
+            # which is also how a local stub server is plugged in
+            if provider == "gpt":
+                client = OpenAI(
+                    api_key=api_key, base_url=base_url, http_client=_build_http_client()
+                )
+            elif provider == "claude":
+                client = anthropic.Anthropic(
+                    api_key=api_key, base_url=base_url, http_client=_build_http_client()
+                )
+            else:
+                raise ValueError(
+                    f"{provider} is not supported. Currently supported: 'gpt' or 'claude'"
+                )
+            _clients[key] = client
+    return client
+
+
+def get_openai_client(api_key: str, base_url: str = None) -> OpenAI:
+    """
+    Returns the pooled OpenAI client for api_key, creating it on first use.
+    """
+    return _get_client("gpt", api_key, base_url)
+
+
+def get_anthropic_client(api_key: str, base_url: str = None) -> anthropic.Anthropic:
+    """
+    Returns the pooled Anthropic client for api_key, creating it on first use.
+    """
+    return _get_client("claude", api_key, base_url)
+
+
+def _get_async_client(provider: str, api_key: str, base_url: str = None):
+    # Several loops may run in different threads (e.g. Streamlit sessions), hence the lock
+    loop = asyncio.get_running_loop()
+    key = (provider, api_key, base_url)
+    with _async_clients_lock:
+        for closed_loop in [other for other in _async_clients if other.is_closed()]:
+            del _async_clients[closed_loop]
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get(key)
+        if client is not None:
+            return client
+        if provider == "gpt":
+            client = AsyncOpenAI(
+                api_key=api_key, base_url=base_url, http_client=_build_async_http_client()
+            )
+        elif provider == "claude":
+            client = anthropic.AsyncAnthropic(
+                api_key=api_key, base_url=base_url, http_client=_build_async_http_client()
+            )
+        else:
+            raise ValueError(
+                f"{provider} is not supported. Currently supported: 'gpt' or 'claude'"
+            )
+        loop_clients[key] = client
+    return client
+
+
+def get_async_openai_client(api_key: str, base_url: str = None) -> AsyncOpenAI:
+    """
+    Returns the pooled AsyncOpenAI client for api_key, creating it on first use.
+    """
+    return _get_async_client("gpt", api_key, base_url)
+
+
+def get_async_anthropic_client(
+    api_key: str, base_url: str = None
+) -> anthropic.AsyncAnthropic:
+    """
+    Returns the pooled AsyncAnthropic client for api_key, creating it on first use.
+    """
+    return _get_async_client("claude", api_key, base_url)
+
+
+def close_clients():
+    """
+    Closes every pooled client and its connections, e.g. on shutdown or after rotating API keys.
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+async def close_async_clients():
+    """
+    Closes the pooled async clients of the running event loop. Await it before the loop ends.
+    """
+    with _async_clients_lock:
+        loop_clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in loop_clients.values():
+        await client.close()
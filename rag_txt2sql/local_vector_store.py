@@ -0,0 +1,265 @@
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import BaseNode, NodeWithScore, QueryBundle, TextNode
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from dotenv import load_dotenv
+import numpy as np
+import threading
+import glob
+import json
+import time
+import os
+
+load_dotenv()
+
+# Written before format versioning; still read when there is no INDEX_FILENAME
+EMBEDDINGS_FILENAME = "embeddings.npy"
+DOCUMENTS_FILENAME = "documents.json"
+# Names the current embeddings/documents pair, which is immutable once written
+INDEX_FILENAME = "index.json"
+
+
+def get_local_index_dir(index_name: str) -> str:
+    LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", "local_index")
+    return os.path.join(LOCAL_INDEX_DIR, index_name)
+
+
+class LocalSchemaIndex:
+    """
+    In-process schema index holding one L2-normalised float32 row per table schema.
+
+    The schema catalog is small (a few dozen CREATE TABLE documents), so top-k is answered with
+    a single matrix-vector product instead of a round trip to a hosted vector database.
+    """
+
+    def __init__(self, embeddings: np.ndarray, documents: list[dict], metadata: dict = None):
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(documents):
+            raise ValueError(
+                "embeddings must be a 2D matrix with one row per document."
+            )
+        self.embeddings = embeddings
+        self.documents = documents
+        # Index-wide facts such as the embedding model and dimension the rows came from
+        self.metadata = metadata or {}
+        # Set by load() and save(); identifies the files this index was read from
+        self.version = None
+
+    @classmethod
+    def from_nodes(cls, nodes: list[BaseNode]) -> "LocalSchemaIndex":
+        """
+        Builds an index from nodes that already carry embeddings (e.g. IngestionPipeline output).
+        """
+        if not nodes:
+            raise ValueError("Cannot build a local index without any nodes.")
+        if any(node.embedding is None for node in nodes):
+            raise ValueError("Every node must be embedded before building a local index.")
+
+        embeddings = np.ascontiguousarray(
+            [node.embedding for node in nodes], dtype=np.float32
+        )
+        documents = [
+            {"id": node.node_id, "text": node.get_content(), "metadata": node.metadata}
+            for node in nodes
+        ]
+        return cls(_normalize_rows(embeddings), documents)
+
+    def upsert(self, nodes: list[BaseNode], remove_ids: list[str] = ()) -> "LocalSchemaIndex":
+        """
+        Returns a new index with nodes added or replaced by node_id and remove_ids dropped.
+        Rows for every other document are carried over without re-embedding.
+        """
+        dropped = set(remove_ids) | {node.node_id for node in nodes}
+        kept = [i for i, document in enumerate(self.documents) if document["id"] not in dropped]
+        documents = [self.documents[i] for i in kept]
+        embeddings = np.asarray(self.embeddings[kept], dtype=np.float32)
+        if nodes:
+            added = LocalSchemaIndex.from_nodes(nodes)
+            documents += added.documents
+            embeddings = np.concatenate([embeddings, added.embeddings])
+        return LocalSchemaIndex(embeddings, documents, dict(self.metadata))
+
+    @staticmethod
+    def read_version(directory: str) -> dict | None:
+        """
+        Returns the index pointer of directory ({"version", "embeddings", "documents",
+        "metadata"}), or None for an index saved before versioning.
+        """
+        try:
+            with open(os.path.join(directory, INDEX_FILENAME), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "LocalSchemaIndex":
+        pointer = cls.read_version(directory)
+        if pointer is None:
+            pointer = {
+                "version": None,
+                "embeddings": EMBEDDINGS_FILENAME,
+                "documents": DOCUMENTS_FILENAME,
+            }
+        embeddings_path = os.path.join(directory, pointer["embeddings"])
+        documents_path = os.path.join(directory, pointer["documents"])
+        if not os.path.exists(embeddings_path) or not os.path.exists(documents_path):
+            raise FileNotFoundError(
+                f"No local schema index found in {directory}. Run create_vector_database.py first."
+            )
+
+        embeddings = np.load(embeddings_path, mmap_mode="r" if mmap else None)
+        with open(documents_path, "r", encoding="utf-8") as f:
+            documents = json.load(f)
+        index = cls(embeddings, documents, pointer.get("metadata"))
+        index.version = pointer["version"]
+        return index
+
+    def save(self, directory: str):
+        """
+        Writes the index under new versioned file names and then swaps INDEX_FILENAME to point
+        at them with os.replace. Files that live processes have memory-mapped are never
+        rewritten, so a reader sees either the old pair or the new one, never a mix.
+        """
+        os.makedirs(directory, exist_ok=True)
+        version = str(time.time_ns())
+        embeddings_name = f"embeddings-{version}.npy"
+        documents_name = f"documents-{version}.json"
+
+        def write_atomically(name: str, write):
+            temporary_path = os.path.join(directory, f".{name}.tmp")
+            with open(temporary_path, "wb") as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, os.path.join(directory, name))
+
+        write_atomically(
+            embeddings_name,
+            lambda f: np.save(f, np.ascontiguousarray(self.embeddings, dtype=np.float32)),
+        )
+        write_atomically(
+            documents_name, lambda f: f.write(json.dumps(self.documents).encode("utf-8"))
+        )
+        previous = self.read_version(directory)
+        pointer = {
+            "version": version,
+            "embeddings": embeddings_name,
+            "documents": documents_name,
+            "metadata": self.metadata,
+        }
+        write_atomically(
+            INDEX_FILENAME, lambda f: f.write(json.dumps(pointer).encode("utf-8"))
+        )
+        self.version = version
+        _remove_stale_versions(directory, keep=[pointer, previous])
+
+    def query(self, query_embedding: list[float], top_k: int = 5) -> list[NodeWithScore]:
+        """
+        Returns the top_k most similar schemas to the query embedding, by cosine similarity.
+        """
+        query_vector = _normalize_rows(
+            np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        )[0]
+        scores = self.embeddings @ query_vector
+        return [self._to_node(i, scores[i]) for i in _top_k_indices(scores, top_k)]
+
+    def query_batch(
+        self, query_embeddings: list[list[float]], top_k: int = 5
+    ) -> list[list[NodeWithScore]]:
+        """
+        Answers many queries with one matrix product, returning one result list per query.
+        """
+        query_matrix = _normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        scores = query_matrix @ self.embeddings.T
+        return [
+            [self._to_node(i, row[i]) for i in _top_k_indices(row, top_k)]
+            for row in scores
+        ]
+
+    def _to_node(self, position: int, score: float) -> NodeWithScore:
+        document = self.documents[position]
+        node = TextNode(
+            id_=document["id"], text=document["text"], metadata=document["metadata"]
+        )
+        return NodeWithScore(node=node, score=float(score))
+
+
+class LocalSchemaRetriever(BaseRetriever):
+    """
+    Retriever over a LocalSchemaIndex. Given the index directory, it checks the index pointer's
+    mtime before each query and reloads when another process has saved a new version.
+    """
+
+    def __init__(
+        self,
+        index: LocalSchemaIndex,
+        embed_model: BaseEmbedding,
+        top_k: int = 5,
+        directory: str = None,
+    ):
+        self._index = index
+        self._embed_model = embed_model
+        self._top_k = top_k
+        self._directory = directory
+        self._pointer_mtime = self._read_pointer_mtime()
+        self._reload_lock = threading.Lock()
+        super().__init__()
+
+    def _read_pointer_mtime(self) -> int | None:
+        if self._directory is None:
+            return None
+        try:
+            return os.stat(os.path.join(self._directory, INDEX_FILENAME)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _current_index(self) -> LocalSchemaIndex:
+        if self._directory is None:
+            return self._index
+        mtime = self._read_pointer_mtime()
+        if mtime != self._pointer_mtime:
+            with self._reload_lock:
+                if mtime != self._pointer_mtime:
+                    pointer = LocalSchemaIndex.read_version(self._directory)
+                    if pointer is not None and pointer["version"] != self._index.version:
+                        self._index = LocalSchemaIndex.load(self._directory)
+                    self._pointer_mtime = mtime
+        return self._index
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        query_embedding = query_bundle.embedding
+        if query_embedding is None:
+            query_embedding = self._embed_model.get_query_embedding(query_bundle.query_str)
+        return self._current_index().query(query_embedding, self._top_k)
+
+    def retrieve_batch(self, query_embeddings: list[list[float]]) -> list[list[NodeWithScore]]:
+        return self._current_index().query_batch(query_embeddings, self._top_k)
+
+
+def _remove_stale_versions(directory: str, keep: list[dict | None]):
+    # The previous version is kept for readers that have not noticed the swap yet
+    kept_names = {
+        name for pointer in keep if pointer for name in (pointer["embeddings"], pointer["documents"])
+    }
+    stale = glob.glob(os.path.join(directory, "embeddings-*.npy")) + glob.glob(
+        os.path.join(directory, "documents-*.json")
+    )
+    for path in stale:
+        if os.path.basename(path) not in kept_names:
+            try:
+                os.remove(path)
+            except OSError:
+                # Still mapped by a reader on a platform that forbids it; next save retries
+                pass
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    top_k = min(top_k, scores.shape[0])
+    if top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    return candidates[np.argsort(-scores[candidates])]
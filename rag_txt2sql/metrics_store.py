@@ -0,0 +1,171 @@
+from dotenv import load_dotenv
+import sqlite3
+import threading
+import json
+import time
+import os
+
+load_dotenv()
+
+
+class MetricsStore:
+    """
+    Append-only usage metrics in a SQLite database in WAL mode.
+
+    Every answered query is one INSERT into the queries table and counters are bumped with a
+    single UPSERT, so concurrent Streamlit sessions and processes never lose updates and
+    never rewrite a shared file. Totals are aggregated on read.
+    """
+
+    def __init__(self, path: str, legacy_json_path: str = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS queries (
+                id INTEGER PRIMARY KEY,
+                created_at REAL NOT NULL,
+                model TEXT,
+                latency_seconds REAL,
+                ttft_seconds REAL,
+                n_prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                n_generated_tokens INTEGER NOT NULL DEFAULT 0,
+                n_cached_tokens INTEGER NOT NULL DEFAULT 0,
+                cost REAL NOT NULL DEFAULT 0,
+                n_attempts INTEGER NOT NULL DEFAULT 0,
+                cache_hit INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value REAL NOT NULL)"
+        )
+        self._connection.commit()
+        if legacy_json_path:
+            self._import_legacy_json(legacy_json_path)
+
+    def _import_legacy_json(self, legacy_json_path: str):
+        # Carries the totals of the old metrics JSON file over, once
+        if not os.path.exists(legacy_json_path):
+            return
+        with open(legacy_json_path, "r") as f:
+            data = json.load(f)
+        with self._lock:
+            with self._connection:
+                imported = self._connection.execute(
+                    "INSERT OR IGNORE INTO counters (name, value) VALUES ('legacy_imported', 1)"
+                ).rowcount
+                if imported:
+                    for name, value in [
+                        ("visitor_count", data.get("visitor_count") or 0),
+                        ("legacy_cost", data.get("total_cost") or 0.0),
+                    ]:
+                        self._increment(name, value)
+
+    def _increment(self, name: str, amount: float):
+        self._connection.execute(
+            """
+            INSERT INTO counters (name, value) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+            """,
+            (name, amount),
+        )
+
+    def increment(self, name: str, amount: float = 1):
+        with self._lock:
+            with self._connection:
+                self._increment(name, amount)
+
+    def get_counter(self, name: str) -> float:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM counters WHERE name = ?", (name,)
+            ).fetchone()
+        return 0 if row is None else row[0]
+
+    def record_query(self, output: dict, latency_seconds: float, error: str = None):
+        """
+        Appends one answered query, taking model, tokens, cost, TTFT and attempts from the
+        LLMQueryHandler output dict.
+        """
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    """
+                    INSERT INTO queries (
+                        created_at, model, latency_seconds, ttft_seconds, n_prompt_tokens,
+                        n_generated_tokens, n_cached_tokens, cost, n_attempts, cache_hit, error
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        time.time(),
+                        output.get("MODEL"),
+                        latency_seconds,
+                        output.get("TTFT_SECONDS"),
+                        output.get("N_PROMPT_TOKENS", 0),
+                        output.get("N_GENERATED_TOKENS", 0),
+                        output.get("N_CACHED_TOKENS", 0),
+                        output.get("COST", 0.0),
+                        len(output.get("ATTEMPTS", [])),
+                        int(bool(output.get("CACHE_HIT"))),
+                        error,
+                    ),
+                )
+
+    def record_late_candidate(self, attempt: dict):
+        """
+        Adds the tokens and cost of a speculative candidate that finished after its question
+        was answered, so the totals include every billed generation.
+        """
+        with self._lock:
+            with self._connection:
+                self._increment("late_candidate_cost", attempt.get("COST", 0.0))
+                self._increment(
+                    "late_candidate_tokens",
+                    attempt.get("N_PROMPT_TOKENS", 0) + attempt.get("N_GENERATED_TOKENS", 0),
+                )
+
+    def totals(self) -> dict:
+        with self._lock:
+            n_queries, cost, latency, n_tokens, n_retries = self._connection.execute(
+                """
+                SELECT COUNT(*), TOTAL(cost), AVG(latency_seconds),
+                       TOTAL(n_prompt_tokens + n_generated_tokens),
+                       TOTAL(MAX(n_attempts - 1, 0))
+                FROM queries
+                """
+            ).fetchone()
+            counters = dict(self._connection.execute("SELECT name, value FROM counters"))
+        return {
+            "n_queries": n_queries,
+            "total_cost": cost
+            + counters.get("legacy_cost", 0.0)
+            + counters.get("late_candidate_cost", 0.0),
+            "avg_latency_seconds": latency,
+            "total_tokens": int(n_tokens + counters.get("late_candidate_tokens", 0)),
+            "total_retries": int(n_retries),
+            "visitor_count": int(counters.get("visitor_count", 0)),
+        }
+
+
+_metrics_store = None
+_metrics_store_lock = threading.Lock()
+
+
+def get_metrics_store() -> MetricsStore:
+    """
+    Returns the process-wide metrics store at METRICS_DB_PATH, importing the totals of the
+    legacy METRIC_FILENAME JSON file the first time the database is created.
+    """
+    global _metrics_store
+    with _metrics_store_lock:
+        if _metrics_store is None:
+            _metrics_store = MetricsStore(
+                path=os.environ.get("METRICS_DB_PATH", "metrics.sqlite3"),
+                legacy_json_path=os.environ.get("METRIC_FILENAME"),
+            )
+    return _metrics_store
@@ -0,0 +1,222 @@
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ratelimit import limits, sleep_and_retry
+from collections import deque
+from dotenv import load_dotenv
+import openai
+import asyncio
+import hashlib
+import threading
+import random
+import json
+import time
+import os
+from llm_clients import get_openai_client
+from schema_compaction import count_tokens
+
+try:
+    from utils import setup_logger
+
+    logger = setup_logger(__name__)
+except Exception:
+    import logging
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Transient failures retried with backoff; the SDK's own retries are disabled so that every
+# attempt goes through the rate limiters. APITimeoutError is an APIConnectionError.
+_RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+
+class TokenRateLimiter:
+    """
+    Sliding one-minute window over tokens sent. acquire() blocks until the request fits; a
+    single request larger than the whole budget is let through on an otherwise empty window.
+    """
+
+    def __init__(self, tokens_per_minute: int, period: float = 60.0):
+        self.tokens_per_minute = tokens_per_minute
+        self.period = period
+        self._sent = deque()
+        self._in_window = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, n_tokens: int):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and self._sent[0][0] <= now - self.period:
+                    self._in_window -= self._sent.popleft()[1]
+                if not self._sent or self._in_window + n_tokens <= self.tokens_per_minute:
+                    self._sent.append((now, n_tokens))
+                    self._in_window += n_tokens
+                    return
+                wait = self._sent[0][0] + self.period - now
+            time.sleep(max(wait, 0.01))
+
+
+class EmbeddingCheckpoint:
+    """
+    Append-only JSON lines file of embeddings computed during an ingestion run, keyed on
+    (model, text). Every finished batch is flushed to disk, so a run that dies on a quota
+    error or a crash resumes without paying for the batches it already embedded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._embeddings: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line may be cut short by the crash being resumed from
+                        continue
+                    self._embeddings[entry["key"]] = entry["embedding"]
+            logger.info(f"Resuming from {len(self._embeddings)} checkpointed embeddings")
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> list[float] | None:
+        return self._embeddings.get(key)
+
+    def add(self, entries: dict[str, list[float]]):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for key, embedding in entries.items():
+                    f.write(json.dumps({"key": key, "embedding": embedding}) + "\n")
+            self._embeddings.update(entries)
+
+    def remove(self):
+        # Called once the ingested embeddings are safely in the index
+        with self._lock:
+            self._embeddings.clear()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class RateLimitedOpenAIEmbedding(BaseEmbedding):
+    """
+    OpenAI embeddings for bulk ingestion.
+
+    Batches of embed_batch_size texts are sent concurrently by max_workers threads, under a
+    requests-per-minute limit (ratelimit) and a tokens-per-minute limit counted locally with
+    tiktoken. 429 and 5xx responses, connection errors and timeouts are retried with
+    exponential backoff and jitter, honouring Retry-After. With a checkpoint_path, embedded batches are checkpointed as they finish.
+    """
+
+    api_key: str = Field(description="The OpenAI API key.")
+    max_workers: int = Field(default=4, gt=0)
+    requests_per_minute: int = Field(default=3000, gt=0)
+    tokens_per_minute: int = Field(default=1000000, gt=0)
+    max_retries: int = Field(default=6, ge=0)
+    checkpoint_path: str | None = Field(default=None)
+
+    _request_slot = PrivateAttr()
+    _token_limiter: TokenRateLimiter = PrivateAttr()
+    _checkpoint: EmbeddingCheckpoint | None = PrivateAttr()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._request_slot = sleep_and_retry(
+            limits(calls=self.requests_per_minute, period=60)(lambda: None)
+        )
+        self._token_limiter = TokenRateLimiter(self.tokens_per_minute)
+        self._checkpoint = (
+            EmbeddingCheckpoint(self.checkpoint_path) if self.checkpoint_path else None
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RateLimitedOpenAIEmbedding"
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        n_tokens = sum(count_tokens(text, self.model_name) for text in texts)
+        # The SDK's own retries would bypass the limiters, so backoff is handled here
+        client = get_openai_client(self.api_key).with_options(max_retries=0)
+        for attempt in range(self.max_retries + 1):
+            self._request_slot()
+            self._token_limiter.acquire(n_tokens)
+            try:
+                response = client.embeddings.create(model=self.model_name, input=texts)
+                return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+            except _RETRYABLE_ERRORS as e:
+                # An exhausted quota will not recover by waiting
+                if attempt == self.max_retries or e.code == "insufficient_quota":
+                    raise
+                # Connection errors and timeouts come without a response
+                response = getattr(e, "response", None)
+                retry_after = None if response is None else response.headers.get("retry-after")
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = min(2**attempt, 60) + random.uniform(0, 1)
+                logger.warning(
+                    f"Embedding request failed with {type(e).__name__} (attempt {attempt + 1}); "
+                    f"retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return self._embed(texts)
+
+    def get_text_embedding_batch(
+        self, texts: list[str], show_progress: bool = False, **kwargs
+    ) -> list[list[float]]:
+        keys = [EmbeddingCheckpoint.make_key(self.model_name, text) for text in texts]
+        embeddings = [
+            self._checkpoint.get(key) if self._checkpoint else None for key in keys
+        ]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        batches = [
+            missing[start : start + self.embed_batch_size]
+            for start in range(0, len(missing), self.embed_batch_size)
+        ]
+        if len(missing) < len(texts):
+            logger.info(f"Reusing {len(texts) - len(missing)} checkpointed embeddings")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self._embed, [texts[i] for i in batch]): batch
+                for batch in batches
+            }
+            error = None
+            for n_done, future in enumerate(as_completed(futures), start=1):
+                batch = futures[future]
+                try:
+                    batch_embeddings = future.result()
+                except Exception as e:
+                    # Keep checkpointing the batches that do finish before giving up
+                    error = error or e
+                    continue
+                for i, embedding in zip(batch, batch_embeddings):
+                    embeddings[i] = embedding
+                if self._checkpoint:
+                    self._checkpoint.add({keys[i]: embeddings[i] for i in batch})
+                if show_progress:
+                    logger.info(f"Embedded {n_done}/{len(batches)} batches")
+        if error is not None:
+            raise error
+        return embeddings
+
+    def remove_checkpoint(self):
+        if self._checkpoint:
+            self._checkpoint.remove()
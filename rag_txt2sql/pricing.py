@@ -0,0 +1,206 @@
+from dataclasses import dataclass
+from dotenv import load_dotenv
+import numpy as np
+import pandas as pd
+import argparse
+import threading
+import json
+import re
+import os
+
+try:
+    from utils import setup_logger
+
+    logger = setup_logger(__name__)
+except Exception:
+    import logging
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DEFAULT_PRICING_FILE = os.path.join(os.path.dirname(__file__), "model_pricing.json")
+
+# A dated snapshot or -latest pointer of a priced model, e.g. claude-3-5-sonnet-20241022,
+# gpt-4o-mini-2024-07-18 or claude-3-opus-latest. Only the whole suffix is stripped.
+_SNAPSHOT_SUFFIX = re.compile(r"^(?P<base>.+)-(?:\d{4}-\d{2}-\d{2}|\d{8}|latest)$")
+
+
+@dataclass(frozen=True)
+class ModelPricing:
+    """
+    USD per 1M tokens. cached_input and cache_write default to the input rate.
+    """
+
+    input: float
+    output: float
+    cached_input: float = None
+    cache_write: float = None
+
+    def rates(self) -> tuple[float, float, float, float]:
+        return (
+            self.input,
+            self.output,
+            self.input if self.cached_input is None else self.cached_input,
+            self.input if self.cache_write is None else self.cache_write,
+        )
+
+
+class PricingRegistry:
+    """
+    Per-model token prices. A model name is matched exactly, then through the alias table,
+    then with a trailing snapshot date or -latest removed, so claude-3-haiku-20240307
+    resolves to claude-3-haiku. There is no open-ended prefix matching: gpt-4o must never be
+    priced as gpt-4.
+
+    Resolved names are memoized. Unknown models are logged with a warning and priced at $0 by
+    cost(); cost_frame() leaves them as NaN so gaps stay visible in reports.
+    """
+
+    def __init__(self, prices: dict[str, ModelPricing], aliases: dict[str, str] = None):
+        self.prices = prices
+        self.aliases = aliases or {}
+        self._resolved: dict[str, ModelPricing | None] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str) -> "PricingRegistry":
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        return cls(
+            {model: ModelPricing(**rates) for model, rates in config["models"].items()},
+            config.get("aliases", {}),
+        )
+
+    def _resolve(self, model: str) -> ModelPricing | None:
+        if not model:
+            return None
+        for name in (model, self.aliases.get(model)):
+            if name in self.prices:
+                return self.prices[name]
+        match = _SNAPSHOT_SUFFIX.match(model)
+        if match is not None:
+            base = match.group("base")
+            return self.prices.get(base) or self.prices.get(self.aliases.get(base))
+        return None
+
+    def lookup(self, model: str) -> ModelPricing | None:
+        with self._lock:
+            if model in self._resolved:
+                return self._resolved[model]
+            pricing = self._resolve(model)
+            if pricing is None:
+                logger.warning(
+                    f"No pricing configured for model {model!r}; its calls are costed at $0. "
+                    f"Add it to MODEL_PRICING_FILE."
+                )
+            self._resolved[model] = pricing
+            return pricing
+
+    def cost(
+        self,
+        model: str,
+        n_prompt_tokens: int,
+        n_generated_tokens: int,
+        n_cached_tokens: int = 0,
+        n_cache_write_tokens: int = 0,
+    ) -> float:
+        """
+        Cost of one call. n_prompt_tokens includes the cached and cache-write tokens.
+        """
+        pricing = self.lookup(model)
+        if pricing is None:
+            return 0.0
+        input_rate, output_rate, cached_rate, cache_write_rate = pricing.rates()
+        n_uncached_tokens = n_prompt_tokens - n_cached_tokens - n_cache_write_tokens
+        return (
+            n_uncached_tokens * input_rate
+            + n_cached_tokens * cached_rate
+            + n_cache_write_tokens * cache_write_rate
+            + n_generated_tokens * output_rate
+        ) / 1e6
+
+    def cost_frame(
+        self,
+        usage: pd.DataFrame,
+        model_column: str = "model",
+        prompt_column: str = "n_prompt_tokens",
+        generated_column: str = "n_generated_tokens",
+        cached_column: str = "n_cached_tokens",
+        cache_write_column: str = "n_cache_write_tokens",
+    ) -> pd.Series:
+        """
+        Vectorized cost of many usage records, e.g. batch_query output.
+
+        Each distinct model is resolved once, and the per-row rates are gathered with a single
+        NumPy take, so millions of rows are priced in one pass. The cached and cache-write
+        columns are optional. Rows whose model has no pricing are NaN.
+
+        Parameters:
+        ---
+        usage (pd.DataFrame): One row per LLM call with a model name and token counts.
+
+        Returns:
+        ---
+        pd.Series: Cost in USD per row, aligned with usage.index.
+        """
+        codes, models = pd.factorize(usage[model_column])
+        rates = np.full((len(models) + 1, 4), np.nan)
+        for i, model in enumerate(models):
+            pricing = self.lookup(model)
+            if pricing is not None:
+                rates[i] = pricing.rates()
+        # factorize marks missing model names with -1, which picks the all-NaN last row
+        row_rates = rates[codes]
+
+        def column(name: str) -> np.ndarray:
+            if name not in usage:
+                return np.zeros(len(usage))
+            return usage[name].fillna(0).to_numpy(dtype=np.float64)
+
+        n_prompt_tokens = column(prompt_column)
+        n_generated_tokens = column(generated_column)
+        n_cached_tokens = column(cached_column)
+        n_cache_write_tokens = column(cache_write_column)
+        n_uncached_tokens = n_prompt_tokens - n_cached_tokens - n_cache_write_tokens
+        cost = (
+            n_uncached_tokens * row_rates[:, 0]
+            + n_generated_tokens * row_rates[:, 1]
+            + n_cached_tokens * row_rates[:, 2]
+            + n_cache_write_tokens * row_rates[:, 3]
+        ) / 1e6
+        return pd.Series(cost, index=usage.index, name="cost")
+
+
+_pricing_registry = None
+_pricing_registry_lock = threading.Lock()
+
+
+def get_pricing_registry() -> PricingRegistry:
+    """
+    Returns the process-wide registry loaded from MODEL_PRICING_FILE (model_pricing.json).
+    """
+    global _pricing_registry
+    with _pricing_registry_lock:
+        if _pricing_registry is None:
+            _pricing_registry = PricingRegistry.from_file(
+                os.environ.get("MODEL_PRICING_FILE", DEFAULT_PRICING_FILE)
+            )
+    return _pricing_registry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Total LLM cost per model for usage records in a JSON lines or CSV file."
+    )
+    parser.add_argument("usage_file")
+    args = parser.parse_args()
+
+    if args.usage_file.endswith(".csv"):
+        usage = pd.read_csv(args.usage_file)
+    else:
+        usage = pd.read_json(args.usage_file, lines=True)
+    usage["cost"] = get_pricing_registry().cost_frame(usage)
+    print(usage.groupby("model", dropna=False)["cost"].agg(calls="size", cost="sum"))
+    print(f"Total: ${usage['cost'].sum():.4f} ({usage['cost'].isna().sum()} unpriced calls)")
@@ -1,10 +1,20 @@
-from openai import OpenAI
-import anthropic
-import pandas as pd
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+import threading
+import time
 import re
 import os
-from query_vector_database import query_database
+from query_vector_database import query_database, get_embed_model
+from embedding_cache import get_embedding_cache
+from llm_clients import get_openai_client, get_anthropic_client
+from sql_engine import get_engine, ExecutionResult
+from sql_validation import get_validator
+from schema_compaction import compact_schemas, schema_table_names, SCHEMA_TOKEN_BUDGET
+from system_prompt import SCHEMA_SECTION_HEADER
+from pricing import get_pricing_registry
+from result_cache import get_result_cache, make_cache_key, compute_schema_fingerprint
+from lexical_index import get_lexical_index
+from metrics_store import get_metrics_store
 
 try:
     from utils import setup_logger
@@ -16,6 +26,233 @@ except Exception:
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger(__name__)
 
+SCHEMAS_FILE_PATH = os.environ.get("SCHEMAS_FILE_PATH", "schemas.txt")
+HYBRID_RETRIEVAL = os.environ.get("HYBRID_RETRIEVAL", "1") == "1"
+# Error recorded for speculative candidates that finished after the winner and were not run
+LATE_CANDIDATE_ERROR = "Not executed: another candidate already returned rows."
+
+
+def parse_candidates(spec: str | None) -> list[dict] | None:
+    """
+    Parses a comma separated list of model[:temperature] entries, e.g.
+    "claude-3-haiku-20240307,gpt-3.5-turbo-0125:0.7", into speculative candidates.
+    """
+    if not spec or not spec.strip():
+        return None
+    candidates = []
+    for entry in spec.split(","):
+        model, _, temperature = entry.strip().partition(":")
+        candidate = {"model": model.strip()}
+        if temperature.strip():
+            candidate["temperature"] = float(temperature)
+        candidates.append(candidate)
+    return candidates
+
+
+class StreamedCompletion:
+    """
+    Accumulates a streamed OpenAI or Anthropic completion into the same output dict as a
+    non-streamed one, calling stream_callback with (token, sql_so_far) as tokens arrive.
+
+    The sync and async handlers only differ in how they iterate the stream, so both feed its
+    chunks or events to add().
+    """
+
+    def __init__(self, service: str, model: str, stream_callback: Callable[[str, str], None]):
+        self.service = service
+        self.model = model
+        self.stream_callback = stream_callback
+        self.start = time.perf_counter()
+        self.sql_query = ""
+        self.ttft = None
+        self.usage = None
+        self.n_generated_tokens = 0
+
+    def add(self, event):
+        if self.service == "gpt":
+            self.model = event.model or self.model
+            if event.usage is not None:
+                self.usage = event.usage
+            if event.choices and event.choices[0].delta.content:
+                self._add_token(event.choices[0].delta.content)
+        elif event.type == "message_start":
+            self.usage, self.model = event.message.usage, event.message.model
+        elif event.type == "message_delta":
+            self.n_generated_tokens = event.usage.output_tokens
+        elif event.type == "content_block_delta" and getattr(event.delta, "text", None):
+            self._add_token(event.delta.text)
+
+    def _add_token(self, token: str):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.start
+        self.sql_query += token
+        self.stream_callback(token, self.sql_query)
+
+    def output(self) -> dict:
+        output = {"SQL_QUERY": self.sql_query, "MODEL": self.model, "TTFT_SECONDS": self.ttft}
+        if self.service == "gpt":
+            output.update(LLMQueryHandler._gpt_token_counts(self.usage))
+        else:
+            output.update(
+                LLMQueryHandler._claude_token_counts(self.usage, self.n_generated_tokens)
+            )
+        return output
+
+
+class RepairLoop:
+    """
+    Bookkeeping of the generate, validate, execute and repair cycle for one question, shared
+    by LLMQueryHandler and AsyncLLMQueryHandler so that only the LLM and database calls
+    differ between them.
+
+    Drive it with `while loop.next_attempt(): ... loop.record(output, result)`; messages
+    holds the conversation to send on the current attempt. SQL the LLM already tried is not
+    validated or executed again: previous_result returns its earlier result.
+    """
+
+    def __init__(
+        self,
+        handler: "LLMQueryHandler",
+        user_prompt: str,
+        initial_messages: list[dict],
+        max_attempts: int,
+    ):
+        self.handler = handler
+        self.user_prompt = user_prompt
+        self.initial_messages = initial_messages
+        self.max_attempts = max_attempts
+        self.messages = initial_messages
+        self.attempt = 0
+        self.attempts = []
+        self.output = self.result = None
+        self._tried_sql: dict[str, ExecutionResult] = {}
+        self._done = False
+        self._start = None
+
+    @property
+    def is_repair(self) -> bool:
+        return self.attempt > 1
+
+    def next_attempt(self) -> bool:
+        if self._done or self.attempt >= self.max_attempts:
+            return False
+        self.attempt += 1
+        logger.info(f"Generating SQL Query from LLM (Attempt {self.attempt}/{self.max_attempts})")
+        self._start = time.perf_counter()
+        return True
+
+    @staticmethod
+    def _normalize_sql(sql_query: str) -> str:
+        return " ".join(sql_query.split()).lower()
+
+    def previous_result(self, sql_query: str) -> ExecutionResult | None:
+        return self._tried_sql.get(self._normalize_sql(sql_query))
+
+    def record(self, output: dict, result: ExecutionResult):
+        """
+        Records the attempt and prepares the repair messages, or ends the loop once the result
+        has rows or the LLM repeats SQL it already tried.
+        """
+        sql_query = output["SQL_QUERY"]
+        logger.info(f"SQL Query generated on Attempt {self.attempt}: {sql_query}")
+        self.output, self.result = output, result
+        self.attempts.append(self.handler._attempt_record(self.attempt, output, result, self._start))
+        self.handler._log_usage(output)
+
+        normalized_sql = self._normalize_sql(sql_query)
+        if normalized_sql in self._tried_sql:
+            logger.info("LLM returned a previously tried SQL Query. Stopping repair.")
+            self._done = True
+            return
+        self._tried_sql[normalized_sql] = result
+
+        user_reprompt = self.handler._repair_reprompt(result, self.user_prompt)
+        if user_reprompt is None:
+            self._done = True
+            return
+
+        logger.debug("Re-prompting the LLM with %s", user_reprompt)
+        self.messages = self.initial_messages + [
+            {"role": "assistant", "content": sql_query},
+            {"role": "user", "content": user_reprompt},
+        ]
+
+    def summary(self) -> tuple[ExecutionResult, dict]:
+        return self.result, self.handler._summarize_attempts(self.output, self.attempts)
+
+
+class Speculation:
+    """
+    Shared state of one speculative generation: the candidates' attempt records and the
+    winner, the first candidate whose SQL runs and returns rows. Candidates finishing after
+    the winner are not executed (late_result), but their generation is billed: until close()
+    they are recorded in the returned attempts, afterwards their tokens and cost go to the
+    metrics store. Thread-safe, so it serves both thread and asyncio candidates.
+    """
+
+    def __init__(self, handler: "LLMQueryHandler", user_prompt: str, system_prompt: str):
+        self.handler = handler
+        self.user_prompt = user_prompt
+        self.system_prompt = system_prompt
+        self.attempts = []
+        self.output = self.result = None
+        self.won = False
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def messages(self, model: str) -> list[dict]:
+        return self.handler._build_initial_messages(self.system_prompt, self.user_prompt, model)
+
+    def late_result(self, output: dict) -> ExecutionResult | None:
+        """
+        The result standing in for a candidate generated after the winner, or None when the
+        candidate should still be validated and executed.
+        """
+        if not self.won:
+            return None
+        return ExecutionResult(output["SQL_QUERY"], error=LATE_CANDIDATE_ERROR)
+
+    def finish(
+        self, index: int, candidate: dict, output: dict, result: ExecutionResult, start: float
+    ) -> bool:
+        """
+        Records a finished candidate and returns True if it is the winner. Candidates
+        finishing after close() are added to the metrics store instead.
+        """
+        model = candidate.get("model", self.handler.model)
+        if result.error == LATE_CANDIDATE_ERROR:
+            logger.info(f"Discarding late candidate {index} ({model})")
+        record = self.handler._attempt_record(index, output, result, start, model)
+        record["CANDIDATE"] = candidate
+        self.handler._log_usage(output, model)
+        with self._lock:
+            late = self.closed
+            if not late:
+                self.attempts.append(record)
+                if not self.won:
+                    self.output, self.result = output, result
+                    self.won = result.error is None and not result.is_empty
+                    if self.won:
+                        logger.info(f"Speculative candidate {index} won: {output['SQL_QUERY']}")
+                        return True
+        if late:
+            get_metrics_store().record_late_candidate(record)
+        return False
+
+    def fail(self, index: int, error: Exception):
+        logger.error(f"Speculative candidate {index} failed: {error}")
+
+    def close(self) -> tuple[ExecutionResult, dict]:
+        """
+        Returns the winner, or the last executed candidate, with the attempts finished so far.
+        """
+        with self._lock:
+            self.closed = True
+            if self.output is None:
+                raise RuntimeError("Every speculative candidate failed to generate a SQL query.")
+            return self.result, self.handler._summarize_attempts(self.output, list(self.attempts))
+
+
 class LLMQueryHandler:
 
 
@@ -27,6 +264,9 @@ class LLMQueryHandler:
         db_path: str,
         index_name: str = None,
         top_k=5,
+        max_rows: int = None,
+        candidates: list[dict] = None,
+        stream_callback: Callable[[str, str], None] = None,
     ):
         self.model = model
         self.vector_store = vector_store
@@ -34,6 +274,12 @@ class LLMQueryHandler:
         self.db_path = db_path
         self.index_name = index_name
         self.top_k = top_k
+        # Rows fetched per execution; None falls back to the engine's hard SQL_MAX_ROWS cap
+        self.max_rows = max_rows
+        # Opt-in speculative mode: [{"model": ..., "temperature": ...}, ...] generated in parallel
+        self.candidates = candidates
+        # When set, generation is streamed and called with (token, sql_so_far) per token
+        self.stream_callback = stream_callback
 
         self.messages = []
 
@@ -41,22 +287,59 @@ class LLMQueryHandler:
         """
         Queries the vector database to retrieve relevant schemas based on a natural language prompt.
 
+        With HYBRID_RETRIEVAL, a question whose every content word is found in the tables it
+        names is answered from the lexical index without an embedding call; otherwise the
+        vector results are fused with the lexical ranking.
+
         Parameters:
         ---
         user_prompt (str): The user's query in natural language.
 
         Returns:
         ----
-        list[str]: A list of texts representing the semantic schemas related to the user's query.
+        list[str]: The related schemas in compact `table(col TYPE, ...)` form, trimmed to
+        SCHEMA_TOKEN_BUDGET tokens.
         """
+        lexical_index = (
+            get_lexical_index(SCHEMAS_FILE_PATH, self.db_path) if HYBRID_RETRIEVAL else None
+        )
+        if lexical_index is not None:
+            schemas = lexical_index.unambiguous_matches(user_prompt, self.top_k)
+            if schemas is not None:
+                logger.info(
+                    f"Lexical match on {len(schemas)} tables; skipping the embedding call"
+                )
+                return self.compact_schemas(schemas)
+
+        embedding_cache = get_embedding_cache()
+        query_embedding = embedding_cache.get_or_compute(
+            self.embed_model,
+            user_prompt,
+            get_embed_model(self.embed_model).get_query_embedding,
+            embedding_type="query",
+        )
+        logger.info(f"Embedding Cache Stats: {embedding_cache.stats()}")
+
         nodes = query_database(
             query=user_prompt,
             vector_store=self.vector_store,
             embed_model=self.embed_model,
             index_name=self.index_name,
             top_k=self.top_k,
+            query_embedding=query_embedding,
         )
-        return [node.get_text() for node in nodes]
+        schemas = [node.get_text() for node in nodes]
+        if lexical_index is not None:
+            schemas = lexical_index.fuse(user_prompt, schemas, self.top_k)
+        return self.compact_schemas(schemas)
+
+    def compact_schemas(self, schemas: list[str]) -> list[str]:
+        compaction = compact_schemas(schemas, SCHEMA_TOKEN_BUDGET, self.model)
+        logger.info(
+            f"Schema Prompt Tokens: {compaction.tokens_before} before compaction, "
+            f"{compaction.tokens_after} after ({len(compaction.dropped)} schemas over budget)"
+        )
+        return compaction.schemas
 
     def generate_initial_query(
         self,
@@ -70,103 +353,210 @@ class LLMQueryHandler:
             system_prompt = self._create_system_prompt(schemas, context)
         else:
             logger.info("Using Given System Prompt...")
+            self.system_prompt = system_prompt
         
         model_service = self._find_model()
         logger.info(f"Using Model From: {model_service}")
-        if model_service == "gpt":
-            logger.info(("Using GPT"))
-            self.messages.append({"role": "system", "content": system_prompt})
-            self.messages.append({"role": "user", "content": user_prompt})
-            logger.info(
-                f"Inserted System Prompt and First User Prompt into Messages: {self.messages}"
-            )
-        elif model_service == "claude":
-            logger.info("Using Claude")
-            self.messages.append({"role": "user", "content": user_prompt})
-            logger.info(
-                f"Inserted System Prompt and First User Prompt into Messages: {self.messages}"
-            )
+        self.messages.extend(self._build_initial_messages(system_prompt, user_prompt))
+        logger.info(
+            f"Inserted System Prompt and First User Prompt into Messages "
+            f"({len(self.messages)} messages)"
+        )
+        logger.debug("Messages: %s", self.messages)
+
+    def _build_initial_messages(
+        self, system_prompt: str, user_prompt: str, model: str = None
+    ) -> list[dict]:
+        # Claude takes the system prompt as a separate argument rather than a message.
+        # The static system prompt always comes first and the question last, so OpenAI's
+        # automatic prefix caching can reuse everything up to the question.
+        if self._find_model(model) == "gpt":
+            return [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ]
+        elif self._find_model(model) == "claude":
+            return [{"role": "user", "content": user_prompt}]
+        return []
 
     def generate_sql_query(
         self,
+        repair: bool = False,
     ) -> dict:
+        return self._complete(
+            self.model,
+            self.messages,
+            self.system_prompt,
+            stream_callback=self.stream_callback,
+            repair=repair,
+        )
 
+    def _complete(
+        self,
+        model: str,
+        messages: list[dict],
+        system_prompt: str,
+        temperature: float = None,
+        stream_callback: Callable[[str, str], None] = None,
+        repair: bool = False,
+    ) -> dict:
+        service = self._find_model(model)
+        if service is None:
+            return None
+        request = self._completion_request(
+            model,
+            messages,
+            system_prompt,
+            temperature,
+            stream=stream_callback is not None,
+            repair=repair,
+        )
+        streamed = StreamedCompletion(service, model, stream_callback) if stream_callback else None
+        if service == "gpt":
+            client = get_openai_client(self._api_key(service))
+            response = client.chat.completions.create(**request)
+        else:
+            client = get_anthropic_client(self._api_key(service))
+            response = client.messages.create(**request)
 
-        if self._find_model() == "gpt":
-            openai_api_key = os.environ.get("OPENAI_API_KEY")
-            if openai_api_key is None:
-                raise ValueError(
-                    "OPENAI_API_KEY must be specified as an environment variable."
-                )
+        if streamed is None:
+            return self._completion_output(service, response)
+        for event in response:
+            streamed.add(event)
+        return streamed.output()
 
-            self.client = OpenAI(api_key=openai_api_key)
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=self.messages,
-            )
-            sql_query = completion.choices[0].message.content
-            n_generated_tokens = completion.usage.completion_tokens
-            n_prompt_tokens = completion.usage.prompt_tokens
-            model = completion.model
-            output = {
-                "SQL_QUERY": sql_query,
-                "MODEL": model,
-                "N_PROMPT_TOKENS": n_prompt_tokens,
-                "N_GENERATED_TOKENS": n_generated_tokens,
-            }
-            return output
-        elif self._find_model() == "claude":
-            claude_api_key = os.environ.get("CLAUDE_API_KEY")
-            if claude_api_key is None:
-                raise ValueError(
-                    "CLAUDE_API_KEY must be specified as an environment variable."
-                )
-            client = anthropic.Anthropic(api_key=claude_api_key)
-            message = client.messages.create(
-                model=self.model,
-                max_tokens=1000,
-                system=self.system_prompt,
-                messages=self.messages,
+    def _completion_request(
+        self,
+        model: str,
+        messages: list[dict],
+        system_prompt: str,
+        temperature: float = None,
+        stream: bool = False,
+        repair: bool = False,
+    ) -> dict:
+        request = {"model": model, "messages": messages}
+        if temperature is not None:
+            request["temperature"] = temperature
+        if self._find_model(model) == "claude":
+            # Claude takes the system prompt as a separate argument rather than a message
+            request.update(
+                max_tokens=1000, system=self._cached_system_blocks(system_prompt, repair)
             )
-            sql_query = message.content[0].text
-            model = message.model
-            n_prompt_tokens = message.usage.input_tokens
-            n_generated_tokens = message.usage.output_tokens
-            output = {
-                "SQL_QUERY": sql_query,
-                "MODEL": model,
-                "N_PROMPT_TOKENS": n_prompt_tokens,
-                "N_GENERATED_TOKENS": n_generated_tokens,
-            }
-            return output
-
-    def _find_model(self):
+        if stream:
+            request["stream"] = True
+            if self._find_model(model) == "gpt":
+                # Usage only arrives in a final chunk when asked for
+                request["extra_body"] = {"stream_options": {"include_usage": True}}
+        return request
+
+    @staticmethod
+    def _api_key(service: str) -> str:
+        name = "OPENAI_API_KEY" if service == "gpt" else "CLAUDE_API_KEY"
+        api_key = os.environ.get(name)
+        if api_key is None:
+            raise ValueError(f"{name} must be specified as an environment variable.")
+        return api_key
+
+    @classmethod
+    def _completion_output(cls, service: str, response) -> dict:
+        if service == "gpt":
+            return cls._gpt_output(response)
+        return cls._claude_output(response)
+
+    @staticmethod
+    def _cached_system_blocks(system_prompt: str, repair: bool = False) -> list[dict]:
+        """
+        Splits the system prompt into Anthropic text blocks with a cache breakpoint after the
+        static instructions (everything before SCHEMA_SECTION_HEADER), so new questions reuse
+        them. The schemas differ per question and writing them to the cache costs 1.25x the
+        input rate, which only pays off if the same question is sent again, so they get a
+        breakpoint on repair attempts only, where later attempts can read them back.
+        Anthropic only caches prefixes past a minimum length; shorter ones are sent uncached.
+        """
+        head, header, tail = system_prompt.partition(SCHEMA_SECTION_HEADER)
+        if not (header and head.strip()):
+            return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+        schemas_block = {"type": "text", "text": header + tail}
+        if repair:
+            schemas_block["cache_control"] = {"type": "ephemeral"}
+        return [
+            {"type": "text", "text": head, "cache_control": {"type": "ephemeral"}},
+            schemas_block,
+        ]
+
+    @classmethod
+    def _gpt_output(cls, completion) -> dict:
+        output = {
+            "SQL_QUERY": completion.choices[0].message.content,
+            "MODEL": completion.model,
+            "TTFT_SECONDS": None,
+        }
+        output.update(cls._gpt_token_counts(completion.usage))
+        return output
+
+    @classmethod
+    def _claude_output(cls, message) -> dict:
+        output = {
+            "SQL_QUERY": message.content[0].text,
+            "MODEL": message.model,
+            "TTFT_SECONDS": None,
+        }
+        output.update(cls._claude_token_counts(message.usage, message.usage.output_tokens))
+        return output
+
+    @staticmethod
+    def _gpt_token_counts(usage) -> dict:
+        # prompt_tokens already includes the cached tokens
+        details = getattr(usage, "prompt_tokens_details", None)
+        return {
+            "N_PROMPT_TOKENS": getattr(usage, "prompt_tokens", 0),
+            "N_GENERATED_TOKENS": getattr(usage, "completion_tokens", 0),
+            "N_CACHED_TOKENS": getattr(details, "cached_tokens", None) or 0,
+            "N_CACHE_WRITE_TOKENS": 0,
+        }
+
+    @staticmethod
+    def _claude_token_counts(usage, n_generated_tokens: int) -> dict:
+        # input_tokens excludes the tokens read from or written to the cache
+        n_cached_tokens = getattr(usage, "cache_read_input_tokens", None) or 0
+        n_cache_write_tokens = getattr(usage, "cache_creation_input_tokens", None) or 0
+        return {
+            "N_PROMPT_TOKENS": getattr(usage, "input_tokens", 0)
+            + n_cached_tokens
+            + n_cache_write_tokens,
+            "N_GENERATED_TOKENS": n_generated_tokens,
+            "N_CACHED_TOKENS": n_cached_tokens,
+            "N_CACHE_WRITE_TOKENS": n_cache_write_tokens,
+        }
+
+    def _find_model(self, model: str = None):
         pattern = r"(gpt|claude)"
-        match = re.search(pattern, self.model)
+        match = re.search(pattern, model or self.model)
         if match:
             return match.group()
         else:
             return None
 
-    def _find_claude_model(self):
-        if self._find_model() == "claude":
-            pattern = r"(opus|sonnet|haiku)"
-            match = re.search(pattern, self.model)
-            if match:
-                return match.group()
-            else:
-                return None
-        else:
-            return None
-
     def _create_system_prompt(self, schemas: list[str], context: str) -> str:
+        schemas = "\n\n".join(schemas)
         self.system_prompt = f"""
-        SQL Schema:
+        {context}
 
-        {schemas}
+        {SCHEMA_SECTION_HEADER}
 
-        {context}
+        {schemas}
         """
+        return self.system_prompt
+
+    def _result_cache_key(self, schemas, user_prompt, context, system_prompt) -> tuple[str, str]:
+        cache_key = make_cache_key(
+            self.model,
+            system_prompt if system_prompt is not None else f"{schemas}\n{context}",
+            user_prompt,
+            self.db_path,
+            self.candidates,
+        )
+        return cache_key, compute_schema_fingerprint(self.db_path, SCHEMAS_FILE_PATH)
 
     def process_user_query(
         self,
@@ -180,93 +570,266 @@ class LLMQueryHandler:
         if retry_count > max_retries:
             return None, None
 
+        result_cache = get_result_cache()
+        cache_key, fingerprint = self._result_cache_key(
+            schemas, user_prompt, context, system_prompt
+        )
+        cached_output = result_cache.get(cache_key, fingerprint)
+        if cached_output is not None:
+            result = self.execute_sql_on_db(self.db_path, cached_output["SQL_QUERY"])
+            if result.error is None:
+                logger.info(f"Serving SQL Query from Result Cache: {result_cache.stats()}")
+                return result, self._cache_hit_output(cached_output)
+
+        max_attempts = max_retries - retry_count + 1
+        speculative_output = None
+        if self.candidates:
+            result, speculative_output = self._generate_speculative(
+                schemas, user_prompt, context, system_prompt
+            )
+        if speculative_output is None or not self._has_rows(result):
+            if speculative_output is not None:
+                logger.info("No speculative candidate returned rows. Falling back to repair.")
+            result, output = self._generate_and_execute(
+                schemas, user_prompt, context, system_prompt, max_attempts
+            )
+            output = self._with_speculative_attempts(output, speculative_output)
+        else:
+            output = speculative_output
+        # Only SQL that ran and produced rows is worth serving again
+        if self._has_rows(result):
+            result_cache.put(cache_key, output, fingerprint)
+        return result, output
+
+    @staticmethod
+    def _has_rows(result: ExecutionResult) -> bool:
+        return result.error is None and not result.is_empty
+
+    @staticmethod
+    def _cache_hit_output(cached_output: dict) -> dict:
+        cached_output.update(
+            {
+                "N_PROMPT_TOKENS": 0,
+                "N_GENERATED_TOKENS": 0,
+                "N_CACHED_TOKENS": 0,
+                "N_CACHE_WRITE_TOKENS": 0,
+                "COST": 0.0,
+                "TTFT_SECONDS": None,
+                "ATTEMPTS": [],
+                "CACHE_HIT": True,
+            }
+        )
+        return cached_output
+
+    @classmethod
+    def _with_speculative_attempts(cls, output: dict, speculative_output: dict | None) -> dict:
+        # The repair fallback is billed on top of the speculation that preceded it
+        if speculative_output is None:
+            return output
+        return cls._summarize_attempts(
+            output, speculative_output["ATTEMPTS"] + output["ATTEMPTS"]
+        )
+
+    def _generate_and_execute(
+        self, schemas, user_prompt, context, system_prompt, max_attempts=1
+    ):
+        """
+        Repair engine: generates, validates and executes SQL for up to max_attempts attempts.
+
+        Every repair attempt sends a compact prompt (system prompt, original question, last SQL
+        and its error) instead of the growing conversation, and the loop stops early once the
+        LLM returns SQL it already tried. Per-attempt latency, tokens and cost are recorded
+        under output["ATTEMPTS"]; the token counts in output are totals over all attempts.
+        """
+        self.messages = []
         self.generate_initial_query(schemas, user_prompt, context, system_prompt)
-        logger.info("Generating SQL Query from LLM")
-        output = self.generate_sql_query()
-        sql_query = output["SQL_QUERY"]
-        logger.info(f"SQL Query generated on First Try: {sql_query}")
-        df, error = self.execute_sql_on_db(self.db_path, sql_query)
-        cost = self.calculate_query_execution_cost(
-            output["N_PROMPT_TOKENS"], output["N_GENERATED_TOKENS"]
+        repair = RepairLoop(self, user_prompt, list(self.messages), max_attempts)
+        while repair.next_attempt():
+            self.messages = repair.messages
+            output = self.generate_sql_query(repair=repair.is_repair)
+            sql_query = output["SQL_QUERY"]
+            repair.record(
+                output,
+                repair.previous_result(sql_query)
+                or self._validate(sql_query, schemas)
+                or self.execute_sql_on_db(self.db_path, sql_query),
+            )
+        return repair.summary()
+
+    def _generate_speculative(self, schemas, user_prompt, context, system_prompt):
+        """
+        Sends one generation request per entry in self.candidates in parallel, then validates
+        and executes each candidate as soon as it arrives. The first candidate that runs and
+        returns rows wins; candidates finishing after it skip execution. If none returns
+        rows, the last executed candidate is returned.
+
+        This returns as soon as a candidate wins. output["ATTEMPTS"] holds one record per
+        candidate finished by then, priced by its own model. Generations still in flight keep
+        running in the background, since their requests are billed anyway, and their tokens
+        and cost are added to the metrics store when they finish.
+        """
+        if system_prompt is None:
+            system_prompt = self._create_system_prompt(schemas, context)
+        speculation = Speculation(self, user_prompt, system_prompt)
+
+        def run_candidate(index: int, candidate: dict) -> bool:
+            model = candidate.get("model", self.model)
+            start = time.perf_counter()
+            try:
+                output = self._complete(
+                    model, speculation.messages(model), system_prompt, candidate.get("temperature")
+                )
+                sql_query = output["SQL_QUERY"]
+                result = (
+                    speculation.late_result(output)
+                    or self._validate(sql_query, schemas)
+                    or self.execute_sql_on_db(self.db_path, sql_query)
+                )
+            except Exception as e:
+                speculation.fail(index, e)
+                return False
+            return speculation.finish(index, candidate, output, result, start)
+
+        logger.info(f"Generating {len(self.candidates)} speculative SQL Query candidates")
+        executor = ThreadPoolExecutor(max_workers=len(self.candidates))
+        futures = [
+            executor.submit(run_candidate, index, candidate)
+            for index, candidate in enumerate(self.candidates, start=1)
+        ]
+        try:
+            for future in as_completed(futures):
+                if future.result():
+                    break
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return speculation.close()
+
+    def _repair_reprompt(self, result: ExecutionResult, user_prompt: str) -> str | None:
+        """
+        Returns the repair prompt for a failed or empty result, or None if no repair is needed.
+        """
+        if result.error:
+            reason = "Rejected Query" if result.rejected else "Error"
+            logger.info(f"Re-prompting the LLM due to {reason}: {result.error}")
+            return self._error_reprompt(result.error, user_prompt)
+        elif result.is_empty:
+            logger.info("Re-prompting the LLM due to empty table output")
+            return self._empty_result_reprompt(user_prompt)
+        return None
+
+    def _attempt_record(
+        self,
+        attempt: int,
+        output: dict,
+        result: ExecutionResult,
+        start: float,
+        model: str = None,
+    ) -> dict:
+        model = model or self.model
+        return {
+            "ATTEMPT": attempt,
+            "MODEL": model,
+            "SQL_QUERY": output["SQL_QUERY"],
+            "LATENCY_SECONDS": time.perf_counter() - start,
+            "TTFT_SECONDS": output.get("TTFT_SECONDS"),
+            "N_PROMPT_TOKENS": output["N_PROMPT_TOKENS"],
+            "N_GENERATED_TOKENS": output["N_GENERATED_TOKENS"],
+            "N_CACHED_TOKENS": output["N_CACHED_TOKENS"],
+            "N_CACHE_WRITE_TOKENS": output["N_CACHE_WRITE_TOKENS"],
+            "COST": self._output_cost(output, model),
+            "ERROR": result.error,
+            "N_ROWS": result.n_rows,
+        }
+
+    @staticmethod
+    def _summarize_attempts(output: dict, attempts: list[dict]) -> dict:
+        summary = dict(output)
+        summary["N_PROMPT_TOKENS"] = sum(a["N_PROMPT_TOKENS"] for a in attempts)
+        summary["N_GENERATED_TOKENS"] = sum(a["N_GENERATED_TOKENS"] for a in attempts)
+        summary["N_CACHED_TOKENS"] = sum(a["N_CACHED_TOKENS"] for a in attempts)
+        summary["N_CACHE_WRITE_TOKENS"] = sum(a["N_CACHE_WRITE_TOKENS"] for a in attempts)
+        summary["COST"] = sum(a["COST"] for a in attempts)
+        # Time to the first token the user saw, not that of the last repair attempt
+        summary["TTFT_SECONDS"] = attempts[0]["TTFT_SECONDS"] if attempts else None
+        summary["ATTEMPTS"] = attempts
+        return summary
+
+    def _validate(self, sql_query: str, schemas: list[str]) -> ExecutionResult | None:
+        """
+        Prepares sql_query against a schema-only copy of the database. Returns a failed
+        ExecutionResult carrying feedback for the re-prompt, or None if the query may be run.
+        """
+        retrieved_tables = schema_table_names(schemas)
+        validation = get_validator(self.db_path).validate(sql_query, retrieved_tables)
+        if not validation.ok:
+            logger.info(f"SQL Query failed validation: {validation.error}")
+            return ExecutionResult(
+                sql_query, error=validation.feedback, failed_validation=True
+            )
+
+        outside_schemas = validation.tables - retrieved_tables
+        if retrieved_tables and outside_schemas:
+            logger.info(f"SQL Query reads tables outside the retrieved schemas: {outside_schemas}")
+        return None
+
+    def _output_cost(self, output: dict, model: str = None) -> float:
+        return self.calculate_query_execution_cost(
+            output["N_PROMPT_TOKENS"],
+            output["N_GENERATED_TOKENS"],
+            model,
+            output["N_CACHED_TOKENS"],
+            output["N_CACHE_WRITE_TOKENS"],
         )
+
+    def _log_usage(self, output: dict, model: str = None):
+        cost = self._output_cost(output, model)
         logger.info(f"Cost = ${cost:.5f}")
+        if output.get("TTFT_SECONDS") is not None:
+            logger.info(f"Time to First Token: {output['TTFT_SECONDS']:.3f}s")
         logger.info(f"Number of Prompt Tokens: {output['N_PROMPT_TOKENS']}")
+        logger.info(
+            f"Number of Cached Prompt Tokens: {output['N_CACHED_TOKENS']} read, "
+            f"{output['N_CACHE_WRITE_TOKENS']} written"
+        )
         logger.info(f"Number of Generated Tokens: {output['N_GENERATED_TOKENS']}")
-        if error:
-            logger.info(f"Re-prompting the LLM due to Error: {error}")
-            user_reprompt = f"""
-                The SQL query generated from your request resulted in an error when executed against the database. 
-                Here's the error message provided by the database:
 
-                {error}
+    def _error_reprompt(self, error: str, user_prompt: str) -> str:
+        return f"""
+            The SQL query generated from your request resulted in an error when executed against the database. 
+            Here's the error message provided by the database:
 
-                Please review the natural language text query again to address the issues described above and avoid technical terms or 
-                database-specific jargon that might have caused the error. Here's the original query for your reference:
+            {error}
 
-                {user_prompt}
+            Please review the natural language text query again to address the issues described above and avoid technical terms or 
+            database-specific jargon that might have caused the error. Here's the original query for your reference:
 
-                Adjust the query so it conforms to the database schema.
+            {user_prompt}
 
-            """
-            logger.info(f"Re-prompting the LLM with {user_reprompt}")
-            self.messages.extend(
-                [
-                    {"role": "assistant", "content": sql_query},
-                    {"role": "user", "content": user_reprompt},
-                ],
-            )
-            output = self.generate_sql_query()
-            sql_query = output["SQL_QUERY"]
-            df, _ = self.execute_sql_on_db(self.db_path, sql_query)
-            cost = self.calculate_query_execution_cost(
-                output["N_PROMPT_TOKENS"], output["N_GENERATED_TOKENS"]
-            )
-            logger.info(f"Cost = ${cost:.5f}")
-            logger.info(f"Number of Prompt Tokens: {output['N_PROMPT_TOKENS']}")
-            logger.info(f"Number of Generated Tokens: {output['N_GENERATED_TOKENS']}")
-            return df, output
-        elif df.empty:
-            logger.info("Re-prompting the LLM due to empty table output")
-            user_reprompt = f"""
+            Adjust the query so it conforms to the database schema.
 
-                The SQL query executed successfully but returned no results. This could happen for several reasons, 
-                such as filtering criteria being too restrictive or querying data that doesn't exist.
+        """
 
-                Please review the natural language text query and consider adjusting it to broaden the search criteria or 
-                correct any inaccuracies. Here's your original prompt for reference:
+    def _empty_result_reprompt(self, user_prompt: str) -> str:
+        return f"""
 
-                {user_prompt}
+            The SQL query executed successfully but returned no results. This could happen for several reasons, 
+            such as filtering criteria being too restrictive or querying data that doesn't exist.
 
-                Additionally, ensure the query aligns with the available data as described in the database schemas below:
+            Please review the natural language text query and consider adjusting it to broaden the search criteria or 
+            correct any inaccuracies. Here's your original prompt for reference:
 
-                {schemas}
+            {user_prompt}
 
-            """
-            logger.info(f"Re-prompting the LLM with {user_reprompt}")
-            self.messages.extend(
-                [
-                    {"role": "assistant", "content": sql_query},
-                    {"role": "user", "content": user_reprompt},
-                ],
-            )
-            output = self.generate_sql_query()
-            sql_query = output["SQL_QUERY"]
-            df, _ = self.execute_sql_on_db(self.db_path, sql_query)
-            cost = self.calculate_query_execution_cost(
-                output["N_PROMPT_TOKENS"], output["N_GENERATED_TOKENS"]
-            )
-            logger.info(f"Cost = ${cost:.5f}")
-            logger.info(f"Number of Prompt Tokens: {output['N_PROMPT_TOKENS']}")
-            logger.info(f"Number of Generated Tokens: {output['N_GENERATED_TOKENS']}")
-            return df, output
-        else:
-            return df, output
+            Additionally, ensure the query aligns with the available data as described in the database schemas
+            in the system prompt.
+
+        """
 
     def execute_sql_on_db(
         self, db_path: str, query: str, params=None
-    ) -> tuple[pd.DataFrame | None, None | str]:
+    ) -> ExecutionResult:
         """
-        Executes SQL query on specified SQLite3 database with parameters and returns data in a pandas DataFrame.
+        Executes SQL query on specified SQLite3 database with parameters and returns the execution result.
 
         Parameters:
         ----
@@ -276,49 +839,26 @@ class LLMQueryHandler:
 
         Returns:
         ----
-        - pandas.DataFrame: The result of the SQL query as a DataFrame.
+        - ExecutionResult: The result DataFrame or error message, with timing and row count.
+          Only the first max_rows rows are fetched; result.truncated is set when there are more.
         """
-        try:
-            with sqlite3.connect(db_path) as connection:
-                df = pd.read_sql_query(query, connection, params)
-                return df, None
-        except Exception as e:
-            return None, str(e)
+        return get_engine(db_path).execute(query, params, max_rows=self.max_rows)
 
     def calculate_query_execution_cost(
-        self, n_prompt_tokens: int, n_generated_tokens: int
+        self,
+        n_prompt_tokens: int,
+        n_generated_tokens: int,
+        model: str = None,
+        n_cached_tokens: int = 0,
+        n_cache_write_tokens: int = 0,
     ) -> float:
-        
-        input_cost, output_cost = 0, 0
-        if self.model == "gpt-4-0125-preview" or self.model == "gpt-4-1106-preview":
-            input_cost += (n_prompt_tokens * 10) / 1e6
-            output_cost += (n_generated_tokens * 30) / 1e6
-        elif self.model == "gpt-4":
-            input_cost += (n_prompt_tokens * 30) / 1e6
-            output_cost += (n_generated_tokens * 60) / 1e6
-        elif self.model == "gpt-4-32k":
-            input_cost += (n_prompt_tokens * 60) / 1e6
-            output_cost += (n_generated_tokens * 120) / 1e6
-        elif self.model == "gpt-3.5-turbo-0125":
-            input_cost += (n_prompt_tokens * 0.50) / 1e6
-            output_cost += (n_generated_tokens * 1.50) / 1e6
-        elif self.model == "gpt-3.5-turbo-instruct":
-            input_cost += (n_prompt_tokens * 1.50) / 1e6
-            output_cost += (n_generated_tokens * 2.00) / 1e6
-        elif self._find_claude_model() == "opus":
-            input_cost = (n_prompt_tokens * 15) / 1e6
-            output_cost = (n_generated_tokens * 75) / 1e6
-        elif self._find_claude_model() == "sonnet":
-            input_cost = (n_prompt_tokens * 3) / 1e6
-            output_cost = (n_generated_tokens * 15) / 1e6
-        elif self._find_claude_model() == "haiku":
-            input_cost = (n_prompt_tokens * 0.25) / 1e6
-            output_cost = (n_generated_tokens * 1.25) / 1e6
-        # else:
-        #     logger.warning(
-        #         """
-        #         Model not yet supported. Currently supported:
-        #         gpt-4-0125-preview, gpt-4-1106-preview, gpt-4, gpt-4-32k, gpt-3.5-turbo-0125, gpt-3.5-turbo-instruct
-        #         """
-        #     )
-        return input_cost + output_cost
+        # model defaults to the handler's model; speculative candidates pass their own.
+        # n_prompt_tokens includes n_cached_tokens (read from the provider's prompt cache)
+        # and n_cache_write_tokens (written to it). Rates come from MODEL_PRICING_FILE.
+        return get_pricing_registry().cost(
+            model or self.model,
+            n_prompt_tokens,
+            n_generated_tokens,
+            n_cached_tokens,
+            n_cache_write_tokens,
+        )
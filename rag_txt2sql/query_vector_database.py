@@ -1,70 +1,204 @@
 from llama_index.vector_stores.pinecone import PineconeVectorStore
 from llama_index.vector_stores.weaviate import WeaviateVectorStore
 from llama_index.core import VectorStoreIndex
-from llama_index.embeddings.openai import OpenAIEmbedding
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import QueryBundle
+from llama_index.core.base.embeddings.base import BaseEmbedding
 from pinecone import Pinecone
 import weaviate
+from local_vector_store import LocalSchemaIndex, LocalSchemaRetriever, get_local_index_dir
+from embedding_backends import build_embed_model
 from dotenv import load_dotenv
+import threading
 import os
 
-def query_database(
-    query: str,
-    vector_store: str,
-    embed_model: str,
-    embed_batch_size: int = 10,
-    index_name: str = None,
-    top_k: int = 5,
-):
+load_dotenv()
 
-    load_dotenv()
+DEFAULT_INDEX_NAMES = {
+    "pinecone": "schema-index",
+    "weaviate": "SchemaIndex",
+    "local": "schema-index",
+}
+
+# Retrievers are built once per process and shared by every caller (including
+# concurrent Streamlit sessions). Keyed on (vector_store, index_name, embed_model, top_k).
+_retrievers: dict[tuple, BaseRetriever] = {}
+_retrievers_lock = threading.Lock()
+_embed_models: dict[str, BaseEmbedding] = {}
+_embed_models_lock = threading.Lock()
 
-    if vector_store not in ["pinecone", "weaviate"]:
-        raise ValueError(
-            f"{vector_store} is not supported. Currently supported: 'pinecone' or 'weaviate'"
-        )
 
+def _build_vector_store(vector_store: str, index_name: str):
     if vector_store == "pinecone":
         pinecone_api_key = os.environ.get("PINECONE_API_KEY")
         if pinecone_api_key is None:
             raise ValueError(
                 "PINECONE_API_KEY must be specified as an environment variable."
             )
-        if index_name is None:
-            index_name = "schema-index"
-
         pc = Pinecone(api_key=pinecone_api_key)
         pc_index = pc.Index(name=index_name)
-        vector_store = PineconeVectorStore(
-            pinecone_index=pc_index, api_key=pinecone_api_key
-        )
+        return PineconeVectorStore(pinecone_index=pc_index, api_key=pinecone_api_key)
 
     elif vector_store == "weaviate":
-
-        if index_name is None:
-            index_name = "SchemaIndex"
-
         WEAVIATE_HOST = os.environ.get("WEAVIATE_HOST")
         client = weaviate.Client(url=WEAVIATE_HOST)
-        vector_store = WeaviateVectorStore(
-            weaviate_client=client, index_name=index_name
+        return WeaviateVectorStore(weaviate_client=client, index_name=index_name)
+
+
+def get_embed_model(embed_model: str, embed_batch_size: int = 10) -> BaseEmbedding:
+    """
+    Returns the process-wide embedding model used to embed queries for embed_model, an OpenAI
+    model name or 'local:<sentence-transformer>' (see embedding_backends). Local models are
+    loaded once and kept warm in memory.
+    """
+    model = _embed_models.get(embed_model)
+    if model is not None:
+        return model
+
+    with _embed_models_lock:
+        model = _embed_models.get(embed_model)
+        if model is None:
+            model = build_embed_model(embed_model, embed_batch_size)
+            _embed_models[embed_model] = model
+    return model
+
+
+def get_retriever(
+    vector_store: str,
+    embed_model: str,
+    embed_batch_size: int = 10,
+    index_name: str = None,
+    top_k: int = 5,
+) -> BaseRetriever:
+    """
+    Returns the process-wide retriever for the given configuration, building it on first use.
+
+    Parameters:
+    ---
+    vector_store (str): One of 'pinecone', 'weaviate' or 'local'.
+    embed_model (str): The embedding model used to embed queries.
+    embed_batch_size (int): Batch size passed to the embedding model on first build.
+    index_name (str, optional): The vector index to query. Defaults to the store's default index.
+    top_k (int): Number of nodes returned per query.
+
+    Returns:
+    ---
+    BaseRetriever: A retriever that is safe to share across sessions and threads.
+    """
+    if vector_store not in DEFAULT_INDEX_NAMES:
+        raise ValueError(
+            f"{vector_store} is not supported. Currently supported: 'pinecone', 'weaviate' or 'local'"
         )
 
-    openai_api_key = os.environ.get("OPENAI_API_KEY")
-    if openai_api_key is None:
-        raise ValueError("OPENAI_API_KEY must be specified as an environment variable.")
+    if index_name is None:
+        index_name = DEFAULT_INDEX_NAMES[vector_store]
+
+    key = (vector_store, index_name, embed_model, top_k)
+    retriever = _retrievers.get(key)
+    if retriever is not None:
+        return retriever
+
+    with _retrievers_lock:
+        # Another session may have built it while we were waiting for the lock
+        retriever = _retrievers.get(key)
+        if retriever is None:
+            if vector_store == "local":
+                index_dir = get_local_index_dir(index_name)
+                retriever = LocalSchemaRetriever(
+                    LocalSchemaIndex.load(index_dir),
+                    embed_model=get_embed_model(embed_model, embed_batch_size),
+                    top_k=top_k,
+                    directory=index_dir,
+                )
+            else:
+                retriever = VectorStoreIndex.from_vector_store(
+                    vector_store=_build_vector_store(vector_store, index_name),
+                    embed_model=get_embed_model(embed_model, embed_batch_size),
+                ).as_retriever(similarity_top_k=top_k)
+            _retrievers[key] = retriever
+    return retriever
+
+
+def invalidate_retrievers(vector_store: str = None, index_name: str = None) -> int:
+    """
+    Drops cached retrievers so the next query rebuilds them, e.g. after the schema index is rebuilt.
+
+    Parameters:
+    ---
+    vector_store (str, optional): Only drop retrievers for this vector store. Drops all if None.
+    index_name (str, optional): Only drop retrievers for this index. Drops all indexes if None.
+
+    Returns:
+    ---
+    int: The number of retrievers dropped.
+    """
+    with _retrievers_lock:
+        stale_keys = [
+            key
+            for key in _retrievers
+            if (vector_store is None or key[0] == vector_store)
+            and (index_name is None or key[1] == index_name)
+        ]
+        for key in stale_keys:
+            del _retrievers[key]
+    return len(stale_keys)
 
-    retriever = VectorStoreIndex.from_vector_store(
+
+def query_database(
+    query: str,
+    vector_store: str,
+    embed_model: str,
+    embed_batch_size: int = 10,
+    index_name: str = None,
+    top_k: int = 5,
+    query_embedding: list[float] = None,
+):
+    retriever = get_retriever(
         vector_store=vector_store,
-        embed_model=OpenAIEmbedding(
-            model=embed_model, embed_batch_size=embed_batch_size, api_key=openai_api_key
-        ),
-    ).as_retriever(similarity_top_k=top_k)
+        embed_model=embed_model,
+        embed_batch_size=embed_batch_size,
+        index_name=index_name,
+        top_k=top_k,
+    )
 
-    nodes = retriever.retrieve(query)
+    # A precomputed embedding (e.g. from the embedding cache) skips the embedding API call
+    nodes = retriever.retrieve(QueryBundle(query_str=query, embedding=query_embedding))
 
     return nodes
 
 
+def query_database_batch(
+    queries: list[str],
+    query_embeddings: list[list[float]],
+    vector_store: str,
+    embed_model: str,
+    embed_batch_size: int = 10,
+    index_name: str = None,
+    top_k: int = 5,
+):
+    """
+    Retrieves nodes for many pre-embedded queries, returning one node list per query.
+
+    The local backend answers the whole batch with a single matrix product; hosted vector
+    stores are queried once per question.
+    """
+    retriever = get_retriever(
+        vector_store=vector_store,
+        embed_model=embed_model,
+        embed_batch_size=embed_batch_size,
+        index_name=index_name,
+        top_k=top_k,
+    )
+
+    if isinstance(retriever, LocalSchemaRetriever):
+        return retriever.retrieve_batch(query_embeddings)
+
+    return [
+        retriever.retrieve(QueryBundle(query_str=query, embedding=query_embedding))
+        for query, query_embedding in zip(queries, query_embeddings)
+    ]
+
+
 if __name__ == "__main__":
     from utils import setup_logger
 
@@ -0,0 +1,124 @@
+from dotenv import load_dotenv
+from collections import OrderedDict
+from sql_engine import get_engine
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import os
+
+load_dotenv()
+
+
+def make_cache_key(
+    model: str,
+    system_prompt: str,
+    user_prompt: str,
+    db_path: str = None,
+    candidates: list[dict] = None,
+) -> str:
+    """
+    Key of a cached LLM output: the prompts, the model and speculative candidates that
+    answered them, and the database the SQL query ran against.
+    """
+    parts = [
+        model or "",
+        system_prompt or "",
+        user_prompt,
+        os.path.abspath(db_path) if db_path else "",
+        json.dumps(candidates or [], sort_keys=True),
+    ]
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+def compute_schema_fingerprint(db_path: str, schemas_file_path: str = None) -> str:
+    """
+    Cheap fingerprint of everything a cached SQL query depends on besides the prompt.
+
+    Uses the schemas file's size and modification time and SQLite's schema_version, which is
+    bumped on every CREATE/ALTER/DROP, so neither the file nor the tables have to be re-read.
+    """
+    parts = []
+    if schemas_file_path and os.path.exists(schemas_file_path):
+        stat = os.stat(schemas_file_path)
+        parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+    else:
+        parts.append("no-schemas-file")
+
+    try:
+        with get_engine(db_path).connection() as connection:
+            (schema_version,) = connection.execute("PRAGMA schema_version").fetchone()
+        parts.append(str(schema_version))
+    except sqlite3.Error:
+        parts.append("no-db")
+
+    return ":".join(parts)
+
+
+class ResultCache:
+    """
+    Thread-safe in-memory cache of validated LLM outputs with TTL and LRU size-bound eviction.
+
+    Every entry stores the schema fingerprint it was cached under; a lookup with a different
+    fingerprint misses and drops that entry, since its SQL may now be invalid. Entries for
+    other databases, whose fingerprints differ, are left alone.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[str, tuple[float, str, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, fingerprint: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is None
+                or entry[1] != fingerprint
+                or time.monotonic() - entry[0] > self.ttl_seconds
+            ):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[2])
+
+    def put(self, key: str, value: dict, fingerprint: str):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), fingerprint, dict(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """
+    Returns the process-wide result cache configured by RESULT_CACHE_MAX_ENTRIES and
+    RESULT_CACHE_TTL_SECONDS.
+    """
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(
+                max_entries=int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "1000")),
+                ttl_seconds=float(os.environ.get("RESULT_CACHE_TTL_SECONDS", "3600")),
+            )
+    return _result_cache
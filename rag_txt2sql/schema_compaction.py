@@ -0,0 +1,215 @@
+from dataclasses import dataclass, field
+import sqlite3
+import threading
+import re
+import os
+
+SCHEMA_TOKEN_BUDGET = int(os.environ.get("SCHEMA_TOKEN_BUDGET", "2000"))
+
+
+@dataclass
+class CompactionResult:
+    """
+    Compacted schemas, in retrieval order, with the schema prompt size before and after.
+    """
+
+    schemas: list[str]
+    tokens_before: int
+    tokens_after: int
+    dropped: list[str] = field(default_factory=list)
+
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _get_encoding(model: str = None):
+    key = model or ""
+    with _encodings_lock:
+        if key not in _encodings:
+            try:
+                import tiktoken
+
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except Exception:
+                    # Claude and unknown models: cl100k_base is a close enough proxy for budgeting
+                    encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                # tiktoken missing or its encoding files could not be fetched
+                encoding = None
+            _encodings[key] = encoding
+        return _encodings[key]
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    """
+    Counts tokens locally with tiktoken, falling back to ~4 characters per token.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def schema_table_names(schemas: list[str]) -> set[str]:
+    """
+    Returns the lower-cased table names defined in raw CREATE TABLE or compact table(...) schemas.
+    """
+    pattern = r"^\s*(?:CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?)?[\"`\[]?(\w+)[\"`\]]?\s*\("
+    return {
+        name.lower() for name in re.findall(pattern, "\n".join(schemas), re.I | re.M)
+    }
+
+
+def parse_create_table(schema: str) -> tuple[str, list[tuple], list[tuple]] | None:
+    # Let SQLite parse the DDL instead of a hand-rolled grammar
+    match = re.search(r"CREATE\s+TABLE\b.*?;?\s*$", schema, re.I | re.S)
+    if match is None:
+        return None
+    connection = sqlite3.connect(":memory:")
+    try:
+        connection.execute(match.group(0))
+        (table,) = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ).fetchone()
+        columns = connection.execute(f'PRAGMA table_info("{table}")').fetchall()
+        foreign_keys = connection.execute(f'PRAGMA foreign_key_list("{table}")').fetchall()
+    except (sqlite3.Error, sqlite3.Warning, TypeError):
+        return None
+    finally:
+        connection.close()
+    return table, columns, foreign_keys
+
+
+def _comment_text(text: str) -> str:
+    # Collapsed to one line, and unable to end the /* */ it is rendered in
+    return " ".join(text.split()).replace("*/", "* /")
+
+
+def schema_comments(schema: str) -> tuple[str, dict[str, str]]:
+    """
+    Returns the description of a schema and its column comments, keyed by lower-cased column.
+
+    The description is the text before CREATE TABLE (e.g. `Table: ...`, `Description: ...`
+    and `Schema:` lines, with the labels removed) plus comments inside the statement that do
+    not follow a column definition. A `--` or single-line `/* */` comment on the same line as
+    a column definition is that column's comment.
+    """
+    match = re.search(r"CREATE\s+TABLE\b", schema, re.I)
+    if match is None:
+        return "", {}
+    description = []
+    for line in schema[: match.start()].splitlines():
+        line = line.strip().lstrip("-").strip()
+        if re.fullmatch(r"(?:Table:.*|Schema:?)", line, re.I):
+            continue
+        line = re.sub(r"^Description:\s*", "", line, flags=re.I)
+        if line:
+            description.append(line)
+
+    columns = {}
+    for line in schema[match.end() :].splitlines():
+        comments = re.findall(r"/\*(.*?)\*/", line)
+        code, _, trailing = re.sub(r"/\*.*?\*/", " ", line).partition("--")
+        comment = _comment_text(" ".join(comments + [trailing]))
+        if not comment:
+            continue
+        name = re.match(r"\s*[\"`\[]?(\w+)", code)
+        # Table constraints and comment-only lines describe the table rather than a column
+        if name and name.group(1).upper() not in {
+            "CONSTRAINT", "PRIMARY", "FOREIGN", "UNIQUE", "CHECK", "TABLE"
+        } and re.search(r"\w+\W+\w", code):
+            columns[name.group(1).lower()] = comment
+        else:
+            description.append(comment)
+    return _comment_text(" ".join(description)), columns
+
+
+def compact_schema(
+    schema: str, known_tables: set[str] = None, with_comments: bool = True
+) -> str:
+    """
+    Renders one CREATE TABLE statement as `table(col TYPE, ...)`.
+
+    Primary keys are marked PK. A foreign key is kept as `col TYPE -> table.col` only when
+    the referenced table is in known_tables (all references are kept when it is None);
+    otherwise it is dropped, since the LLM cannot join a table it has not been shown.
+    With with_comments, the table description is kept as a `-- ...` line above it and column
+    comments as `/* ... */` after their column (see schema_comments).
+    Text that is not a CREATE TABLE statement is returned with its whitespace collapsed.
+    """
+    parsed = parse_create_table(schema)
+    if parsed is None:
+        return " ".join(schema.replace("&", " ").split())
+
+    table, columns, foreign_keys = parsed
+    description, column_comments = schema_comments(schema) if with_comments else ("", {})
+    references = {
+        from_column: f"{to_table}.{to_column}" if to_column else to_table
+        for _, _, to_table, from_column, to_column, *_ in foreign_keys
+        if known_tables is None or to_table.lower() in known_tables
+    }
+    rendered = []
+    for _, name, column_type, _, _, pk in columns:
+        column = f"{name} {column_type}".strip()
+        if pk:
+            column += " PK"
+        if name in references:
+            column += f" -> {references[name]}"
+        if name.lower() in column_comments:
+            column += f" /* {column_comments[name.lower()]} */"
+        rendered.append(column)
+    compact = f"{table}({', '.join(rendered)})"
+    return f"-- {description}\n{compact}" if description else compact
+
+
+def compact_schemas(
+    schemas: list[str], token_budget: int = None, model: str = None
+) -> CompactionResult:
+    """
+    Compacts retrieved schemas and trims them to a token budget.
+
+    Schemas are expected in retrieval order, most relevant first. Once the budget is spent,
+    a schema is kept without its description and comments if that fits, and dropped
+    otherwise, though the most relevant schema is always kept (bare if need be). A budget of None or 0
+    disables trimming.
+
+    Parameters:
+    ---
+    schemas (list[str]): Retrieved schema texts, usually CREATE TABLE statements.
+    token_budget (int): Maximum tokens for the joined schemas.
+    model (str): The LLM the prompt is for, used to pick the tokenizer.
+
+    Returns:
+    ---
+    CompactionResult: The compacted schemas and the token counts before and after.
+    """
+    tokens_before = count_tokens("\n\n".join(schemas), model)
+    known_tables = schema_table_names(schemas)
+
+    kept, dropped, used = [], [], 0
+    for schema in schemas:
+        for with_comments in (True, False):
+            n_tokens = count_tokens(compact_schema(schema, known_tables, with_comments), model) + 1
+            if not token_budget or used + n_tokens <= token_budget:
+                break
+        else:
+            if kept:
+                dropped.append(schema)
+                continue
+        kept.append((schema, with_comments))
+        used += n_tokens
+
+    if dropped:
+        # Re-render so kept tables no longer point at dropped ones
+        known_tables = schema_table_names([schema for schema, _ in kept])
+    compacted = [
+        compact_schema(schema, known_tables, with_comments) for schema, with_comments in kept
+    ]
+    return CompactionResult(
+        schemas=compacted,
+        tokens_before=tokens_before,
+        tokens_after=count_tokens("\n\n".join(compacted), model),
+        dropped=dropped,
+    )
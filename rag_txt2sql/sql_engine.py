@@ -0,0 +1,389 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator
+from pathlib import Path
+from dotenv import load_dotenv
+import pandas as pd
+import sqlite3
+import threading
+import queue
+import time
+import math
+import re
+import os
+
+load_dotenv()
+
+
+@dataclass
+class ExecutionResult:
+    """
+    Outcome of executing one SQL query. Exactly one of df and error is set.
+    """
+
+    sql: str
+    df: pd.DataFrame | None = None
+    error: str | None = None
+    elapsed_seconds: float = 0.0
+    truncated: bool = False
+    # Set when the governor refused or cancelled the query rather than SQLite failing it
+    rejected: bool = False
+    # Set when the query was never run because it failed pre-execution validation
+    failed_validation: bool = False
+
+    @property
+    def n_rows(self) -> int:
+        return 0 if self.df is None else len(self.df)
+
+    @property
+    def is_empty(self) -> bool:
+        return self.error is None and self.n_rows == 0
+
+
+class SQLiteEngine:
+    """
+    Executes generated SQL over a pool of read-only connections to one SQLite database.
+
+    Connections are opened with mode=ro and PRAGMA query_only, so generated SQL can never
+    modify the database, and are tuned once when created instead of on every query.
+    Results are fetched chunk_size rows at a time and stop at max_rows rows or max_bytes of
+    DataFrame memory, whichever comes first.
+
+    Every query is also governed: EXPLAIN QUERY PLAN is checked first and nested full-table
+    scans whose row product exceeds max_scan_rows are rejected without running, and a
+    progress handler cancels execution once query_timeout seconds or max_vm_steps SQLite
+    VM instructions are used up. A budget of 0 disables that check.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        pool_size: int = 4,
+        mmap_size: int = 268435456,
+        cache_size: int = -65536,
+        timeout: float = 30,
+        chunk_size: int = 1000,
+        max_rows: int = 100000,
+        max_bytes: int = 268435456,
+        query_timeout: float = 10,
+        max_vm_steps: int = 0,
+        max_scan_rows: int = 10000000,
+    ):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.query_timeout = query_timeout
+        self.max_vm_steps = max_vm_steps
+        self.max_scan_rows = max_scan_rows
+
+        self._table_row_counts: dict[str, int] = {}
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._n_connections = 0
+        # Bumped by close(), so connections borrowed before it are closed on return instead
+        # of being put back into the pool they no longer count against
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+        # Pooled connections hop between Streamlit script threads, never used by two at once
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        connection.execute("PRAGMA query_only = ON")
+        connection.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        connection.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        connection.execute("PRAGMA temp_store = MEMORY")
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows a connection from the pool, opening a new one while the pool is below pool_size.
+        Raises TimeoutError when every connection stays borrowed for timeout seconds.
+        """
+        with self._lock:
+            generation = self._generation
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._n_connections < self.pool_size
+                if can_open:
+                    self._n_connections += 1
+            if can_open:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._n_connections -= 1
+                    raise
+            else:
+                try:
+                    connection = self._pool.get(timeout=self.timeout)
+                except queue.Empty:
+                    # queue.Empty has no message, which would read as a successful query
+                    raise TimeoutError(
+                        f"Timed out waiting for a SQLite connection: all {self.pool_size} "
+                        f"pooled connections stayed busy for {self.timeout:g}s."
+                    ) from None
+
+        try:
+            yield connection
+        finally:
+            with self._lock:
+                stale = generation != self._generation
+            if stale:
+                connection.close()
+            else:
+                self._pool.put(connection)
+
+    def execute(
+        self, query: str, params=None, max_rows: int = None, max_bytes: int = None
+    ) -> ExecutionResult:
+        """
+        Executes query and returns its ExecutionResult. Errors are captured, never raised.
+
+        At most max_rows rows (default: the engine's max_rows) and roughly max_bytes of data are
+        loaded; result.truncated tells whether the query had more rows than were fetched.
+        """
+        start = time.perf_counter()
+        budget = {}
+        try:
+            with self.connection() as connection:
+                rejection = self.check_query_plan(connection, query, params)
+                if rejection:
+                    return ExecutionResult(
+                        query,
+                        error=rejection,
+                        elapsed_seconds=time.perf_counter() - start,
+                        rejected=True,
+                    )
+
+                with self._governed(connection) as budget:
+                    cursor = connection.execute(query, params or ())
+                    try:
+                        columns = [column[0] for column in cursor.description or []]
+                        chunks = list(self._read_chunks(cursor, columns, max_rows, max_bytes))
+                        truncated = bool(columns) and cursor.fetchone() is not None
+                    finally:
+                        cursor.close()
+        except sqlite3.OperationalError as e:
+            cancelled = budget.get("exceeded")
+            return ExecutionResult(
+                query,
+                error=cancelled or str(e),
+                elapsed_seconds=time.perf_counter() - start,
+                rejected=bool(cancelled),
+            )
+        except Exception as e:
+            return ExecutionResult(
+                query, error=str(e), elapsed_seconds=time.perf_counter() - start
+            )
+
+        if chunks:
+            df = pd.concat(chunks, ignore_index=True)
+        else:
+            df = pd.DataFrame(columns=columns)
+        return ExecutionResult(
+            query,
+            df=df,
+            elapsed_seconds=time.perf_counter() - start,
+            truncated=truncated,
+        )
+
+    def fetch_page(self, query: str, offset: int, page_size: int, params=None) -> ExecutionResult:
+        """
+        Executes up to page_size rows of query from row offset with LIMIT/OFFSET, so later pages
+        can be loaded lazily.
+
+        A page can stop short of page_size at the byte cap, so the next page starts at
+        offset + result.n_rows rather than offset + page_size. One row past the page is
+        requested so result.truncated tells whether more rows follow.
+        """
+        paged_query = (
+            f"SELECT * FROM ({query.strip().rstrip(';')}) "
+            f"LIMIT {int(page_size) + 1} OFFSET {int(offset)}"
+        )
+        return self.execute(paged_query, params, max_rows=page_size)
+
+    def check_query_plan(
+        self, connection: sqlite3.Connection, query: str, params=None
+    ) -> str | None:
+        """
+        Returns the reason to reject query without running it, or None if its plan is acceptable.
+
+        Sibling SCAN steps in EXPLAIN QUERY PLAN are the nested loops of one join; a join of
+        full-table scans visits the product of their row counts.
+        """
+        if not self.max_scan_rows:
+            return None
+        try:
+            plan = connection.execute(f"EXPLAIN QUERY PLAN {query}", params or ()).fetchall()
+        except sqlite3.Error:
+            # Let execution report the error itself
+            return None
+
+        # The plan names tables by their alias when the query gives one
+        aliases = {
+            alias.lower(): table.lower()
+            for table, alias in re.findall(
+                r'(?:\bFROM|\bJOIN|,)\s+"?(\w+)"?(?:\s+(?:AS\s+)?"?(\w+)"?)?',
+                query,
+                flags=re.IGNORECASE,
+            )
+            if alias
+        }
+        tables = self._table_names(connection)
+
+        scans_by_parent: dict[int, list[str]] = {}
+        for _, parent, _, detail in plan:
+            match = re.match(r"SCAN (?:TABLE )?(\w+)", detail)
+            if match and "USING INDEX" not in detail and "USING INTEGER PRIMARY KEY" not in detail:
+                name = match.group(1).lower()
+                table = name if name in tables else aliases.get(name)
+                # Scans of CTEs and subqueries are bounded by the tables they read
+                if table in tables:
+                    scans_by_parent.setdefault(parent, []).append(table)
+
+        for tables in scans_by_parent.values():
+            if len(tables) < 2:
+                continue
+            row_counts = [self._table_row_count(connection, table) for table in tables]
+            n_combinations = math.prod(row_counts)
+            if n_combinations > self.max_scan_rows:
+                return (
+                    f"Query rejected before execution: it joins full scans of "
+                    f"{' x '.join(tables)} (about {n_combinations:,} row combinations, "
+                    f"limit {self.max_scan_rows:,}). Join the tables on their key columns "
+                    f"or filter them so the join does not become a cross join."
+                )
+        return None
+
+    def _table_names(self, connection: sqlite3.Connection) -> set[str]:
+        rows = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ).fetchall()
+        return {name.lower() for (name,) in rows}
+
+    def _table_row_count(self, connection: sqlite3.Connection, table: str) -> int:
+        if table not in self._table_row_counts:
+            try:
+                # MAX(rowid) is an O(log n) estimate of the row count for rowid tables
+                (n_rows,) = connection.execute(f'SELECT MAX(_rowid_) FROM "{table}"').fetchone()
+            except sqlite3.Error:
+                # WITHOUT ROWID tables have no cheap estimate
+                (n_rows,) = connection.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()
+            self._table_row_counts[table] = n_rows or 1
+        return self._table_row_counts[table]
+
+    @contextmanager
+    def _governed(self, connection: sqlite3.Connection):
+        """
+        Installs a progress handler that interrupts the statement once the time or VM step budget
+        is exhausted. Yields a dict whose "exceeded" key holds the reason after a cancellation.
+        """
+        budget = {"exceeded": None}
+        if not self.query_timeout and not self.max_vm_steps:
+            yield budget
+            return
+
+        steps_per_call = 1000
+        deadline = time.monotonic() + self.query_timeout if self.query_timeout else None
+        n_calls = 0
+
+        def progress_handler():
+            nonlocal n_calls
+            n_calls += 1
+            if deadline is not None and time.monotonic() > deadline:
+                budget["exceeded"] = (
+                    f"Query cancelled: it ran longer than the {self.query_timeout:g}s time "
+                    f"budget. Simplify the query or filter the tables it scans."
+                )
+            elif self.max_vm_steps and n_calls * steps_per_call > self.max_vm_steps:
+                budget["exceeded"] = (
+                    f"Query cancelled: it used more than {self.max_vm_steps:,} SQLite VM steps. "
+                    f"Simplify the query or filter the tables it scans."
+                )
+            return 1 if budget["exceeded"] else 0
+
+        connection.set_progress_handler(progress_handler, steps_per_call)
+        try:
+            yield budget
+        finally:
+            connection.set_progress_handler(None, 0)
+
+    def _read_chunks(
+        self,
+        cursor: sqlite3.Cursor,
+        columns: list[str],
+        max_rows: int = None,
+        max_bytes: int = None,
+        chunk_size: int = None,
+    ) -> Iterator[pd.DataFrame]:
+        max_rows = self.max_rows if max_rows is None else max_rows
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        chunk_size = chunk_size or self.chunk_size
+
+        n_rows, n_bytes = 0, 0
+        while columns and n_rows < max_rows and n_bytes < max_bytes:
+            rows = cursor.fetchmany(min(chunk_size, max_rows - n_rows))
+            if not rows:
+                return
+            chunk = pd.DataFrame.from_records(rows, columns=columns)
+            n_rows += len(chunk)
+            n_bytes += int(chunk.memory_usage(deep=True).sum())
+            yield chunk
+
+    def get_column_names(self, query: str) -> list[str]:
+        with self.connection() as connection:
+            cursor = connection.execute(query)
+            try:
+                return [column[0] for column in cursor.description]
+            finally:
+                cursor.close()
+
+    def close(self):
+        """
+        Closes the idle connections. Connections borrowed at the time are closed when returned.
+        """
+        with self._lock:
+            while True:
+                try:
+                    self._pool.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._n_connections = 0
+            self._generation += 1
+
+
+_engines: dict[str, SQLiteEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(db_path: str) -> SQLiteEngine:
+    """
+    Returns the process-wide engine for db_path. Module state survives Streamlit reruns, so
+    every rerun and session shares the same pool.
+    """
+    key = os.path.abspath(db_path)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = SQLiteEngine(
+                db_path,
+                pool_size=int(os.environ.get("SQLITE_POOL_SIZE", "4")),
+                mmap_size=int(os.environ.get("SQLITE_MMAP_SIZE", "268435456")),
+                cache_size=int(os.environ.get("SQLITE_CACHE_SIZE", "-65536")),
+                chunk_size=int(os.environ.get("SQL_CHUNK_SIZE", "1000")),
+                max_rows=int(os.environ.get("SQL_MAX_ROWS", "100000")),
+                max_bytes=int(os.environ.get("SQL_MAX_BYTES", "268435456")),
+                query_timeout=float(os.environ.get("SQL_TIMEOUT_SECONDS", "10")),
+                max_vm_steps=int(os.environ.get("SQL_MAX_VM_STEPS", "0")),
+                max_scan_rows=int(os.environ.get("SQL_MAX_SCAN_ROWS", "10000000")),
+            )
+            _engines[key] = engine
+    return engine
@@ -0,0 +1,172 @@
+from dataclasses import dataclass, field
+from difflib import get_close_matches
+from sql_engine import get_engine
+import sqlite3
+import threading
+import re
+import os
+
+# Caps on the table listing in the repair feedback, so it stays small on large catalogs
+FEEDBACK_MAX_TABLES = 8
+FEEDBACK_MAX_COLUMNS = 40
+FEEDBACK_MAX_SUGGESTIONS = 5
+
+
+@dataclass
+class ValidationResult:
+    """
+    Outcome of preparing one SQL query against the schema. feedback is written for the LLM.
+    """
+
+    ok: bool
+    error: str | None = None
+    feedback: str | None = None
+    tables: set[str] = field(default_factory=set)
+
+
+class SQLValidator:
+    """
+    Prepares generated SQL against an empty, schema-only in-memory copy of a database.
+
+    The copy is rebuilt from sqlite_master whenever the database's schema_version changes.
+    Preparing a statement with EXPLAIN catches syntax errors and unknown tables or columns
+    in microseconds, without touching the real data.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._schema_version = None
+        self._memory = None
+        self._columns: dict[str, list[str]] = {}
+
+    def _refresh(self):
+        with get_engine(self.db_path).connection() as connection:
+            (schema_version,) = connection.execute("PRAGMA schema_version").fetchone()
+            if schema_version == self._schema_version:
+                return
+            rows = connection.execute(
+                """
+                SELECT type, sql FROM sqlite_master
+                WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+                ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END
+                """
+            ).fetchall()
+
+        memory = sqlite3.connect(":memory:", check_same_thread=False)
+        for _, sql in rows:
+            try:
+                memory.execute(sql)
+            except sqlite3.Error:
+                # e.g. virtual tables whose module is not loaded; skip rather than fail
+                continue
+
+        columns = {}
+        for (table,) in memory.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'view')"
+        ).fetchall():
+            columns[table.lower()] = [
+                row[1] for row in memory.execute(f'PRAGMA table_info("{table}")')
+            ]
+
+        if self._memory is not None:
+            self._memory.close()
+        self._memory = memory
+        self._columns = columns
+        self._schema_version = schema_version
+
+    def validate(self, query: str, relevant_tables: set[str] = None) -> ValidationResult:
+        """
+        Prepares query against the schema-only copy. On failure, feedback lists the columns of
+        the tables query names, of the close matches suggested for an unknown name and of
+        relevant_tables (e.g. those of the retrieved schemas), up to FEEDBACK_MAX_TABLES.
+        """
+        with self._lock:
+            self._refresh()
+            tables_read = set()
+
+            def authorizer(action, arg1, arg2, db_name, trigger):
+                if action == sqlite3.SQLITE_READ and arg1:
+                    tables_read.add(arg1.lower())
+                return sqlite3.SQLITE_OK
+
+            self._memory.set_authorizer(authorizer)
+            try:
+                self._memory.execute(f"EXPLAIN {query}").fetchall()
+            except (sqlite3.Error, sqlite3.Warning) as e:
+                error = str(e)
+                return ValidationResult(
+                    ok=False,
+                    error=error,
+                    feedback=self._feedback(query, error, relevant_tables or set()),
+                )
+            finally:
+                self._memory.set_authorizer(None)
+
+        return ValidationResult(ok=True, tables=tables_read)
+
+    def _feedback(self, query: str, error: str, relevant_tables: set[str]) -> str:
+        lines = [
+            "The SQL query failed validation before it was run against the database.",
+            f"Error: {error}",
+        ]
+
+        mentioned = [
+            table for table in self._columns if re.search(rf"\b{re.escape(table)}\b", query, re.I)
+        ]
+        relevant = [table for table in relevant_tables if table in self._columns]
+        suggested_tables = []
+        unknown_table = re.search(r"no such table: (?:\w+\.)?(\w+)", error)
+        unknown_column = re.search(r"no such column: (?:\w+\.)?(\w+)", error)
+        if unknown_table:
+            suggested_tables = get_close_matches(
+                unknown_table.group(1).lower(), list(self._columns), n=3
+            )
+            if suggested_tables:
+                lines.append(f"Did you mean table: {', '.join(suggested_tables)}?")
+        elif unknown_column:
+            candidates = {
+                f"{table}.{column}": (table, column.lower())
+                for table, columns in self._columns.items()
+                for column in columns
+            }
+            matches = get_close_matches(
+                unknown_column.group(1).lower(),
+                list({column for _, column in candidates.values()}),
+                n=3,
+            )
+            suggestions = [name for name, (_, column) in candidates.items() if column in matches]
+            # Prefer the tables in play, since a common name like "id" matches every table of
+            # a large catalog
+            in_play = set(mentioned) | set(relevant)
+            suggestions = (
+                [name for name in suggestions if candidates[name][0] in in_play] or suggestions
+            )[:FEEDBACK_MAX_SUGGESTIONS]
+            suggested_tables = [candidates[name][0] for name in suggestions]
+            if suggestions:
+                lines.append(f"Did you mean column: {', '.join(suggestions)}?")
+
+        listed = list(dict.fromkeys(mentioned + suggested_tables + sorted(relevant)))
+        for table in listed[:FEEDBACK_MAX_TABLES]:
+            columns = self._columns[table]
+            listing = ", ".join(columns[:FEEDBACK_MAX_COLUMNS])
+            if len(columns) > FEEDBACK_MAX_COLUMNS:
+                listing += f", ... ({len(columns) - FEEDBACK_MAX_COLUMNS} more)"
+            lines.append(f"Table {table} has columns: {listing}")
+        return "\n".join(lines)
+
+_validators: dict[str, SQLValidator] = {}
+_validators_lock = threading.Lock()
+
+
+def get_validator(db_path: str) -> SQLValidator:
+    """
+    Returns the process-wide validator for db_path.
+    """
+    key = os.path.abspath(db_path)
+    with _validators_lock:
+        validator = _validators.get(key)
+        if validator is None:
+            validator = SQLValidator(db_path)
+            _validators[key] = validator
+    return validator
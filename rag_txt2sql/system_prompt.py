@@ -1,3 +1,7 @@
+# Everything before this header is identical across requests, so it is kept first for
+# provider-side prompt caching; the retrieved schemas follow it
+SCHEMA_SECTION_HEADER = "## Database Schemas"
+
 sys_prompt="""You are an assistant that translates natural language to SQL queries.
 Your task is to generate syntactically correct SQL queries based on the user's natural language requests and the provided database schema information.
 
@@ -11,11 +15,12 @@ If you are unsure about the user's request or if it is ambiguous, ask clarifying
 
 Always prioritize accuracy and clarity in your SQL query generation.
 
-## 
-{schemas}
-
 {context}
 
+""" + SCHEMA_SECTION_HEADER + """
+
+{schemas}
+
 ## Output only the SQL query without any additional text.
 
 """
\ No newline at end of file
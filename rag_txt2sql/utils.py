@@ -1,8 +1,12 @@
 from dotenv import load_dotenv
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
-import sys
 import hashlib
 import re
+import json
+import queue
+import atexit
+import threading
 from datetime import datetime
 import logging
 
@@ -32,32 +36,92 @@ class DynamicPathFileHandler(logging.FileHandler):
         if not os.path.exists(directory):
             os.makedirs(directory)
 
-        filepath = os.path.join(
-            directory, date_now.strftime("%d%m%Y") + self.base_filename
-        )
+        self.current_date = date_now.strftime("%d%m%Y")
+        filepath = os.path.join(directory, self.current_date + self.base_filename)
         self.currently_logging_to = filepath
-        return filepath
+        return os.path.abspath(filepath)
 
     def emit(self, record):
-        module_name = os.path.basename(
-            sys.argv[0] if sys.argv[0] else "unknown_program"
-        )
-        record_program = os.path.splitext(module_name)[0]
+        # Roll over to the new day's file with the first record after midnight
+        if datetime.now().strftime("%d%m%Y") != self.current_date:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+            self.baseFilename = self._calculate_dynamic_path()
         super().emit(record)
 
 
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "name": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _build_file_handler(directory: str) -> logging.Handler:
+    if os.environ.get("LOG_FORMAT", "text") == "json":
+        os.makedirs(directory, exist_ok=True)
+        handler = RotatingFileHandler(
+            os.path.join(directory, "txt2sql.jsonl"),
+            maxBytes=int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+            backupCount=int(os.environ.get("LOG_BACKUP_COUNT", "5")),
+            encoding="utf-8",
+        )
+        handler.setFormatter(JsonLinesFormatter())
+    else:
+        handler = DynamicPathFileHandler(directory=directory, filename=".log")
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        )
+    return handler
+
+
+_log_queue = None
+_queue_listener = None
+_logging_lock = threading.Lock()
+
+
+def _get_log_queue() -> queue.SimpleQueue:
+    # One listener thread per process owns the file; loggers only enqueue records
+    global _log_queue, _queue_listener
+    with _logging_lock:
+        if _queue_listener is None:
+            LOG_DIR = os.environ.get("LOG_DIR")
+            if LOG_DIR is None:
+                raise ValueError("LOG_DIR must be specified as an environment variable.")
+            _log_queue = queue.SimpleQueue()
+            _queue_listener = QueueListener(
+                _log_queue, _build_file_handler(LOG_DIR), respect_handler_level=True
+            )
+            _queue_listener.start()
+            atexit.register(_queue_listener.stop)
+        return _log_queue
+
+
 def setup_logger(name=__name__):
-    LOG_DIR = os.environ.get("LOG_DIR")
+    """
+    Returns a logger whose records are queued and written to LOG_DIR by a background thread,
+    so logging never blocks the caller on disk I/O.
+
+    Safe to call repeatedly for the same name: the queue handler is only attached once.
+    LOG_FORMAT=json switches from dated text files to size-capped JSON lines
+    (LOG_MAX_BYTES, LOG_BACKUP_COUNT).
+    """
+    log_queue = _get_log_queue()
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
 
-    handler = DynamicPathFileHandler(directory=LOG_DIR, filename=".log")
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    handler.setFormatter(formatter)
-
-    logger.addHandler(handler)
+    if not any(
+        isinstance(handler, QueueHandler) and handler.queue is log_queue
+        for handler in logger.handlers
+    ):
+        logger.addHandler(QueueHandler(log_queue))
 
     return logger
 
@@ -71,7 +135,7 @@ def get_text_hash(text):
 
 
 def check_valid_vector_store(vector_store_name: str) -> bool:
-    if vector_store_name not in ["pinecone", "weaviate"]:
+    if vector_store_name not in ["pinecone", "weaviate", "local"]:
         return False
     else:
         return True
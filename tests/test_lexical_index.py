@@ -0,0 +1,39 @@
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "rag_txt2sql"))
+
+from lexical_index import SchemaLexicalIndex  # noqa: E402
+
+SCHEMAS_FILE_PATH = os.path.join(PROJECT_ROOT, "schemas.txt")
+
+
+def table_names(schemas):
+    return [schema.split("CREATE TABLE ")[1].split()[0] for schema in schemas]
+
+
+def test_named_tables_covering_the_question_skip_the_vector_search():
+    index = SchemaLexicalIndex.from_schema_file(SCHEMAS_FILE_PATH)
+
+    schemas = index.unambiguous_matches("Count allergies per patient ethnicity", top_k=3)
+
+    assert sorted(table_names(schemas)) == ["allergies", "patients"]
+
+
+def test_question_needing_an_unnamed_table_is_fused_with_vector_results():
+    index = SchemaLexicalIndex.from_schema_file(SCHEMAS_FILE_PATH)
+    question = "How many patients have diabetes?"
+
+    # Only patients is named; the diagnosis lives in conditions
+    assert index.unambiguous_matches(question, top_k=3) is None
+
+    vector_schemas = [
+        document.text
+        for title in ["conditions", "careplans", "patients"]
+        for document in index.documents
+        if document.title == title
+    ]
+    schemas = index.fuse(question, vector_schemas, top_k=3)
+
+    assert {"patients", "conditions"} <= set(table_names(schemas))
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "rag_txt2sql"))
+
+from llm_clients import (  # noqa: E402
+    close_async_clients,
+    close_clients,
+    get_anthropic_client,
+    get_async_anthropic_client,
+    get_async_openai_client,
+    get_openai_client,
+)
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """
+    Answers /v1/chat/completions and /v1/messages like OpenAI and Anthropic, recording the
+    client address of every request so connection reuse can be checked.
+    """
+
+    # Keep-alive needs HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.path, self.client_address))
+        if self.path == "/v1/chat/completions":
+            response = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "SELECT 1"},
+                    }
+                ],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12},
+            }
+        elif self.path == "/v1/messages":
+            response = {
+                "id": "msg-stub",
+                "type": "message",
+                "role": "assistant",
+                "model": body["model"],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "content": [{"type": "text", "text": "SELECT 1"}],
+                "usage": {"input_tokens": 10, "output_tokens": 2},
+            }
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubLLMHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setenv("OPENAI_BASE_URL", f"{url}/v1")
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", url)
+    yield server
+    close_clients()
+    server.shutdown()
+    server.server_close()
+
+
+def connections(server, path):
+    return {address for request_path, address in server.requests if request_path == path}
+
+
+def test_pooled_clients_reuse_connections(stub_server):
+    openai_client = get_openai_client("stub-key")
+    anthropic_client = get_anthropic_client("stub-key")
+
+    for _ in range(3):
+        completion = openai_client.chat.completions.create(
+            model="gpt-4o", messages=[{"role": "user", "content": "q"}]
+        )
+        message = anthropic_client.messages.create(
+            model="claude-3-haiku-20240307",
+            max_tokens=100,
+            messages=[{"role": "user", "content": "q"}],
+        )
+        assert completion.choices[0].message.content == "SELECT 1"
+        assert message.content[0].text == "SELECT 1"
+
+    assert get_openai_client("stub-key") is openai_client
+    assert len(stub_server.requests) == 6
+    assert len(connections(stub_server, "/v1/chat/completions")) == 1
+    assert len(connections(stub_server, "/v1/messages")) == 1
+
+
+def test_async_pooled_clients_reuse_connections(stub_server):
+    async def ask_both():
+        for _ in range(3):
+            await get_async_openai_client("stub-key").chat.completions.create(
+                model="gpt-4o", messages=[{"role": "user", "content": "q"}]
+            )
+            await get_async_anthropic_client("stub-key").messages.create(
+                model="claude-3-haiku-20240307",
+                max_tokens=100,
+                messages=[{"role": "user", "content": "q"}],
+            )
+        await close_async_clients()
+
+    asyncio.run(ask_both())
+
+    assert len(stub_server.requests) == 6
+    assert len(connections(stub_server, "/v1/chat/completions")) == 1
+    assert len(connections(stub_server, "/v1/messages")) == 1